@@ -0,0 +1,280 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Scripted stand-ins for `efibootmgr` and `lsblk` and generators for synthetic
+NVRAM tables and block device topologies used by the benchmark suite.
+
+The fake tools keep their state in files named by environment variables:
+
+    FAKE_NVRAM      JSON boot manager state, updated by mutating efibootmgr calls
+    FAKE_TOPOLOGY   JSON block device topology
+    FAKE_EFIVARS    optional efivarfs directory kept in sync with FAKE_NVRAM
+    FAKE_FORKS      file every invocation appends the name of the tool to
+"""
+
+import json
+import os
+import os.path
+import stat
+import struct
+import sys
+import uuid
+
+EFI_GLOBAL_VARIABLE = "8be4df61-93ca-11d2-aa0d-00e098032b8c"
+ESP_PARTTYPE = "c12a7328-f81f-11d2-ba4b-00a0c93ec93b"
+LINUX_PARTTYPE = "0fc63daf-8483-4772-8e79-3d69d8477de4"
+ESP_DISK_PARTITION = 2
+
+def _load (variable):
+    with open (os.environ[variable]) as f:
+        return json.load (f)
+
+def _store (variable, content):
+    with open (os.environ[variable], "w") as f:
+        json.dump (content, f)
+
+def _count (tool):
+    if "FAKE_FORKS" in os.environ:
+        with open (os.environ["FAKE_FORKS"], "a") as f:
+            f.write (tool + "\n")
+
+def generate_topology (disks, partitions, esp_mountpoints):
+    """
+    Generate `disks` NVMe namespaces with `partitions` partitions each. The
+    ESPs are the second partitions of the last disks, one per mountpoint, so
+    discovery has to look past the first partition and the first disks.
+    """
+    result = {"disks": []}
+    minor = 0
+    first_esp_disk = disks - len (esp_mountpoints)
+    for i in range (disks):
+        disk = {"name": "nvme{}n1".format (i), "devno": "259:{}".format (minor), "partitions": []}
+        minor += 1
+        for j in range (1, partitions + 1):
+            esp = i >= first_esp_disk and j == ESP_DISK_PARTITION
+            disk["partitions"].append ({
+                "name": "nvme{}n1p{}".format (i, j),
+                "number": j,
+                "devno": "259:{}".format (minor),
+                "parttype": ESP_PARTTYPE if esp else LINUX_PARTTYPE,
+                "partuuid": str (uuid.UUID (int = minor)),
+                "fstype": "vfat" if esp else "ext4",
+                "mountpoint": esp_mountpoints[i - first_esp_disk] if esp else ("/" if i == 0 and j == 1 else None),
+            })
+            minor += 1
+        result["disks"].append (disk)
+    return result
+
+def generate_nvram (entries):
+    nvram = {"order": [], "current": "0000", "timeout": 1, "entries": {}}
+    for i in range (entries):
+        bootnum = "{:04X}".format (i)
+        nvram["entries"][bootnum] = {
+            "label": "Network boot {}".format (i), "active": i % 3 != 0, "partition": 1,
+            "partuuid": str (uuid.UUID (int = i)), "loader": "\\EFI\\BOOT\\PXE{}.EFI".format (i),
+        }
+        nvram["order"].append (bootnum)
+    return nvram
+
+def format_lsblk (topology):
+    lines = []
+    for disk in topology["disks"]:
+        lines.append ('NAME="/dev/{}" PKNAME="" TYPE="disk" MAJ:MIN="{}" MOUNTPOINT="" FSTYPE="" '
+                      'PARTTYPE="" PARTUUID=""'.format (disk["name"], disk["devno"]))
+        for part in disk["partitions"]:
+            lines.append ('NAME="/dev/{}" PKNAME="/dev/{}" TYPE="part" MAJ:MIN="{}" MOUNTPOINT="{}" FSTYPE="{}" '
+                          'PARTTYPE="{}" PARTUUID="{}"'.format (
+                              part["name"], disk["name"], part["devno"], part["mountpoint"] or "",
+                              part["fstype"], part["parttype"], part["partuuid"]))
+    return "\n".join (lines) + "\n"
+
+def format_efibootmgr (nvram):
+    lines = [
+        "BootCurrent: {}".format (nvram["current"]),
+        "Timeout: {} seconds".format (nvram["timeout"]),
+        "BootOrder: {}".format (",".join (nvram["order"])),
+    ]
+    for bootnum in sorted (nvram["entries"]):
+        entry = nvram["entries"][bootnum]
+        lines.append ("Boot{}{} {}\tHD({},GPT,{},0x800,0x100000)/File({})".format (
+            bootnum, "*" if entry["active"] else " ", entry["label"], entry["partition"],
+            entry["partuuid"], entry["loader"]
+        ))
+    return "\n".join (lines) + "\n"
+
+def _utf16 (text):
+    return (text + "\0").encode ("utf-16-le")
+
+def encode_load_option (entry):
+    hd = struct.pack ("<BBHIQQ", 4, 1, 42, entry["partition"], 0x800, 0x100000)
+    hd += uuid.UUID (entry["partuuid"]).bytes_le + bytes ([2, 2])
+    path = _utf16 (entry["loader"])
+    device_path = hd + struct.pack ("<BBH", 4, 4, 4 + len (path)) + path + struct.pack ("<BBH", 0x7f, 0xff, 4)
+    return struct.pack ("<IH", 1 if entry["active"] else 0, len (device_path)) + _utf16 (entry["label"]) + device_path
+
+def write_efivars (nvram, root):
+    os.makedirs (root, exist_ok = True)
+    for name in os.listdir (root):
+        os.unlink (os.path.join (root, name))
+
+    def write (name, data):
+        with open (os.path.join (root, "{}-{}".format (name, EFI_GLOBAL_VARIABLE)), "wb") as f:
+            f.write (struct.pack ("<I", 7) + data)
+
+    for bootnum, entry in nvram["entries"].items ():
+        write ("Boot" + bootnum, encode_load_option (entry))
+    write ("BootOrder", struct.pack ("<{}H".format (len (nvram["order"])), *(int (n, 16) for n in nvram["order"])))
+    write ("BootCurrent", struct.pack ("<H", int (nvram["current"], 16)))
+    write ("Timeout", struct.pack ("<H", nvram["timeout"]))
+
+def write_sysfs (topology, root):
+    """
+    Lay down sysfs, udev database and mountinfo fixtures for `topology`
+    below `root` and return their paths.
+    """
+    sysfs = os.path.join (root, "sys")
+    devices = os.path.join (sysfs, "devices", "pci0000:00")
+    class_block = os.path.join (sysfs, "class", "block")
+    udev = os.path.join (root, "udev")
+    for path in (devices, class_block, udev):
+        os.makedirs (path, exist_ok = True)
+
+    mountinfo = []
+    for disk in topology["disks"]:
+        disk_path = os.path.join (devices, disk["name"])
+        os.makedirs (disk_path, exist_ok = True)
+        with open (os.path.join (disk_path, "dev"), "w") as f:
+            f.write (disk["devno"] + "\n")
+        os.symlink (os.path.relpath (disk_path, class_block), os.path.join (class_block, disk["name"]))
+
+        for part in disk["partitions"]:
+            part_path = os.path.join (disk_path, part["name"])
+            os.makedirs (part_path, exist_ok = True)
+            with open (os.path.join (part_path, "dev"), "w") as f:
+                f.write (part["devno"] + "\n")
+            with open (os.path.join (part_path, "partition"), "w") as f:
+                f.write ("{}\n".format (part["number"]))
+            os.symlink (os.path.relpath (part_path, class_block), os.path.join (class_block, part["name"]))
+            with open (os.path.join (udev, "b" + part["devno"]), "w") as f:
+                f.write ("E:ID_FS_TYPE={}\nE:ID_PART_ENTRY_TYPE={}\nE:ID_PART_ENTRY_UUID={}\n".format (
+                    part["fstype"], part["parttype"], part["partuuid"]))
+            if part["mountpoint"] is not None:
+                mountinfo.append ("{} 1 {} / {} rw - {} /dev/{} rw".format (
+                    len (mountinfo) + 20, part["devno"], part["mountpoint"], part["fstype"], part["name"]))
+
+    mountinfo_path = os.path.join (root, "mountinfo")
+    with open (mountinfo_path, "w") as f:
+        f.write ("\n".join (mountinfo) + "\n")
+    return sysfs, udev, mountinfo_path
+
+def write_payload (root, files):
+    """
+    Lay down a Clover payload tree with a loader, a few drivers and theme
+    files making up `files` files in total.
+    """
+    clover = os.path.join (root, "EFI", "CLOVER")
+    layout = [os.path.join (clover, "CLOVERX64.efi")]
+    layout += [os.path.join (clover, "drivers", "UEFI", "Driver{}.efi".format (i)) for i in range (min (8, files - 1))]
+    layout += [os.path.join (clover, "themes", "embedded", "icon{}.png".format (i))
+               for i in range (files - len (layout))]
+    for i, path in enumerate (layout):
+        os.makedirs (os.path.dirname (path), exist_ok = True)
+        with open (path, "wb") as f:
+            f.write (os.urandom (512 * 1024 if i == 0 else 4096))
+
+def write_kernels (root, kernels):
+    """
+    Lay down `kernels` kernel images with matching initramfs images and a
+    microcode image like a distribution's /boot.
+    """
+    os.makedirs (root, exist_ok = True)
+    with open (os.path.join (root, "intel-ucode.img"), "wb") as f:
+        f.write (os.urandom (4096))
+    for i in range (kernels):
+        version = "5.{}.0-1".format (i)
+        for name in ("vmlinuz-" + version, "initrd.img-" + version, "config-" + version):
+            with open (os.path.join (root, name), "wb") as f:
+                f.write (os.urandom (4096))
+
+def install_fakes (bin_dir):
+    """
+    Create executable `efibootmgr` and `lsblk` stand-ins in `bin_dir`.
+    """
+    os.makedirs (bin_dir, exist_ok = True)
+    here = os.path.dirname (os.path.abspath (__file__))
+    for tool in ("efibootmgr", "lsblk"):
+        path = os.path.join (bin_dir, tool)
+        with open (path, "w") as f:
+            f.write ("#!{}\nimport sys\nsys.path.insert (0, {!r})\nimport fakes\nfakes.{}_main ()\n".format (
+                sys.executable, here, tool))
+        os.chmod (path, os.stat (path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+def _find_partuuid (disk_name, number):
+    for disk in _load ("FAKE_TOPOLOGY")["disks"]:
+        if "/dev/" + disk["name"] == disk_name:
+            for part in disk["partitions"]:
+                if part["number"] == number:
+                    return part["partuuid"]
+    return str (uuid.UUID (int = 0))
+
+def efibootmgr_main ():
+    _count ("efibootmgr")
+    nvram = _load ("FAKE_NVRAM")
+    args = sys.argv[1:]
+    options = {}
+    flags = set ()
+    i = 0
+    while i < len (args):
+        if args[i] in ("-b", "-d", "-p", "-L", "-l", "-o"):
+            options[args[i]] = args[i + 1]
+            i += 2
+        else:
+            flags.add (args[i])
+            i += 1
+
+    bootnum = options.get ("-b", "").upper ()
+    if "-B" in flags:
+        if bootnum not in nvram["entries"]:
+            sys.stderr.write ("Boot entry {} not found\n".format (bootnum))
+            sys.exit (5)
+        del nvram["entries"][bootnum]
+        nvram["order"] = [num for num in nvram["order"] if num != bootnum]
+    elif "-a" in flags:
+        nvram["entries"][bootnum]["active"] = True
+    elif "-c" in flags:
+        used = set (nvram["entries"])
+        bootnum = next ("{:04X}".format (n) for n in range (0x10000) if "{:04X}".format (n) not in used)
+        partition = int (options.get ("-p", "1"))
+        nvram["entries"][bootnum] = {
+            "label": options.get ("-L", "Linux"), "active": True, "partition": partition,
+            "partuuid": _find_partuuid (options.get ("-d"), partition),
+            "loader": options.get ("-l", "\\EFI\\BOOT\\BOOTX64.EFI").replace ("/", "\\"),
+        }
+        nvram["order"].insert (0, bootnum)
+    elif "-o" in options:
+        nvram["order"] = [num.upper () for num in options["-o"].split (",") if num]
+
+    if flags - {"-v"} or options:
+        _store ("FAKE_NVRAM", nvram)
+        if os.environ.get ("FAKE_EFIVARS"):
+            write_efivars (nvram, os.environ["FAKE_EFIVARS"])
+
+    sys.stdout.write (format_efibootmgr (nvram))
+
+def lsblk_main ():
+    _count ("lsblk")
+    sys.stdout.write (format_lsblk (_load ("FAKE_TOPOLOGY")))
@@ -0,0 +1,123 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Startup benchmark for the clover-config command line entry point.
+
+Runs the CLI entry points in fresh interpreters, records the wall clock time
+and the `python -X importtime` import graph and fails if the median startup
+exceeds the threshold or if modules that should be loaded lazily show up.
+
+    python benchmarks/startup.py [--runs N] [--max-ms MS] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import os.path
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname (os.path.dirname (os.path.abspath (__file__)))
+
+# scenario name -> (python snippet, modules that must not be imported)
+SCENARIOS = {
+    "version": (
+        "import sys\n"
+        "sys.argv = ['clover-config', '--version']\n"
+        "import clover_config\n"
+        "try:\n"
+        "    clover_config.main ()\n"
+        "except SystemExit:\n"
+        "    pass\n",
+        ["colorlog", "systemd", "subprocess", "clover_config.actions", "clover_config.log"]
+    ),
+    "actions": (
+        "import clover_config.actions\n",
+        ["colorlog", "systemd.journal", "logging.handlers", "subprocess", "asyncio", "configparser",
+         "plistlib", "tempfile", "clover_config.menu", "clover_config.plan", "clover_config.config"]
+    ),
+}
+
+def run_python (snippet, *options):
+    env = dict (os.environ)
+    env["PYTHONPATH"] = os.pathsep.join ([ROOT] + [p for p in env.get ("PYTHONPATH", "").split (os.pathsep) if p])
+    start = time.perf_counter ()
+    process = subprocess.run ([sys.executable] + list (options) + ["-c", snippet],
+                              stdout = subprocess.PIPE, stderr = subprocess.PIPE, env = env)
+    elapsed = time.perf_counter () - start
+    if process.returncode != 0:
+        raise RuntimeError (process.stderr.decode ())
+    return elapsed, process.stderr.decode ()
+
+def parse_importtime (output):
+    modules = {}
+    for line in output.splitlines ():
+        if not line.startswith ("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len ("import time:"):].split ("|")
+        modules[name.strip ()] = (int (self_us), int (cumulative_us))
+    return modules
+
+def measure (name, runs):
+    snippet, forbidden = SCENARIOS[name]
+    timings = [run_python (snippet)[0] * 1000 for _ in range (runs)]
+    baseline = [run_python ("pass")[0] * 1000 for _ in range (runs)]
+    _, importtime = run_python (snippet, "-X", "importtime")
+    modules = parse_importtime (importtime)
+    own = {module: times for module, times in modules.items () if module.startswith ("clover_config")}
+
+    return {
+        "median_ms": statistics.median (timings),
+        "interpreter_median_ms": statistics.median (baseline),
+        "import_us": sum (times[0] for times in modules.values ()),
+        "clover_config_import_us": sum (times[0] for times in own.values ()),
+        "modules": len (modules),
+        "unexpected_modules": sorted (module for module in forbidden if module in modules),
+    }
+
+def main ():
+    parser = argparse.ArgumentParser (description = "Benchmark the startup of clover-config.")
+    parser.add_argument ("--runs", type = int, default = 10, help = "number of runs per scenario")
+    parser.add_argument ("--max-ms", type = float, default = 50.0,
+                         help = "maximum median startup time on top of the bare interpreter")
+    parser.add_argument ("--output", help = "write the results as JSON to this file")
+    args = parser.parse_args ()
+
+    results = {name: measure (name, args.runs) for name in sorted (SCENARIOS)}
+    failed = False
+    for name, result in sorted (results.items ()):
+        overhead = result["median_ms"] - result["interpreter_median_ms"]
+        print ("{:<10} median {:7.1f} ms  (+{:6.1f} ms over bare interpreter, {:4d} modules, "
+               "{:7.1f} ms importing)".format (name, result["median_ms"], overhead, result["modules"],
+                                               result["import_us"] / 1000))
+        if overhead > args.max_ms:
+            print ("  FAIL: startup overhead exceeds {:.1f} ms".format (args.max_ms))
+            failed = True
+        if result["unexpected_modules"]:
+            print ("  FAIL: eagerly imported {}".format (", ".join (result["unexpected_modules"])))
+            failed = True
+
+    if args.output is not None:
+        with open (args.output, "w") as f:
+            json.dump (results, f, indent = 2, sort_keys = True)
+
+    sys.exit (1 if failed else 0)
+
+if __name__ == "__main__":
+    main ()
@@ -0,0 +1,268 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark suite for the clover-config actions.
+
+Runs every action against synthetic NVRAM tables and block device topologies
+in fresh processes, with scripted `efibootmgr` and `lsblk` stand-ins first
+on PATH. For each run it records the wall clock latency, the number of
+forked tools and the time spent parsing tool output (taken from the
+--trace-file of the run) and writes all results as JSON for regression
+comparison.
+
+    python benchmarks/suite.py [--entries 10,100,500] [--disks 10,1000]
+                               [--esps N] [--payload-files N]
+                               [--backends tools,native] [--output FILE]
+
+The `tools` backend forces discovery through lsblk and efibootmgr, the
+`native` backend reads sysfs, mountinfo, udev and efivarfs fixtures.
+"""
+
+import argparse
+import json
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import fakes
+
+ROOT = os.path.dirname (os.path.dirname (os.path.abspath (__file__)))
+
+# (label, actions, use the discovery cache) in execution order, every step
+# starts from the NVRAM state the previous step left behind
+STEPS = [
+    ("check-efi", "check-efi", False),
+    ("status", "status", False),
+    ("install", "install", False),
+    ("install (no-op)", "install", False),
+    ("status (warm cache)", "status", True),
+    ("status (warm cache)", "status", True),
+    ("update", "update", False),
+    ("update (no-op)", "update", False),
+    ("remove", "remove", False),
+    ("install update status", "install update status", False),
+]
+
+DRIVER = """
+import json, sys
+settings = json.loads (sys.argv[1])
+import clover_config
+from clover_config.efibootmgr import EFIBootManager
+from clover_config.config import Config
+from clover_config import actions
+for name, value in settings["EFIBootManager"].items ():
+    setattr (EFIBootManager, name, value)
+Config.Path = settings["config"]
+Config.CachePath = None
+actions.MENU_MANIFEST_PATH = settings["manifest"]
+actions.KERNEL_CACHE_PATH = settings["kernel_cache"]
+sys.argv = ["clover-config"] + settings["argv"]
+clover_config.main ()
+"""
+
+CONFIG = """[clover]
+EFIDefault = yes
+MenuFile = {menu}
+PayloadDir = {payload}
+KernelDirs = {boot}
+KernelOptions = root=/dev/nvme0n1p1 rw
+"""
+
+MENU = """[menu]
+timeout = 3
+
+[Linux]
+volume = {partuuid}
+path = \\\\vmlinuz-linux
+options = root=/dev/nvme0n1p1 rw initrd=\\\\initramfs-linux.img
+"""
+
+class Scenario:
+    def __init__ (self, backend, entries, disks, partitions, esps = 1, payload_files = 0, kernels = 0):
+        self.backend = backend
+        self.entries = entries
+        self.disks = disks
+        self.partitions = partitions
+        self.root = tempfile.mkdtemp (prefix = "clover-config-bench-")
+        self.esps = [os.path.join (self.root, "esp{}".format (i) if i else "esp") for i in range (esps)]
+        self.bin = os.path.join (self.root, "bin")
+        for esp in self.esps:
+            os.makedirs (esp)
+        fakes.install_fakes (self.bin)
+
+        self.payload = os.path.join (self.root, "payload")
+        if payload_files > 0:
+            fakes.write_payload (self.payload, payload_files)
+        self.boot = os.path.join (self.root, "boot")
+        fakes.write_kernels (self.boot, kernels)
+
+        self.topology = fakes.generate_topology (disks, partitions, self.esps)
+        self.nvram_path = os.path.join (self.root, "nvram.json")
+        self.topology_path = os.path.join (self.root, "topology.json")
+        with open (self.nvram_path, "w") as f:
+            json.dump (fakes.generate_nvram (entries), f)
+        with open (self.topology_path, "w") as f:
+            json.dump (self.topology, f)
+
+        firmware = os.path.join (self.root, "firmware")
+        self.efivars = os.path.join (firmware, "efivars")
+        missing = os.path.join (self.root, "missing")
+        if backend == "native":
+            fakes.write_efivars (fakes.generate_nvram (entries), self.efivars)
+            sysfs, udev, mountinfo = fakes.write_sysfs (self.topology, self.root)
+        else:
+            os.makedirs (firmware)
+            sysfs, udev, mountinfo = missing, missing, "/proc/self/mountinfo"
+
+        esp = self.topology["disks"][-len (self.esps)]["partitions"][fakes.ESP_DISK_PARTITION - 1]
+        with open (os.path.join (self.root, "menu.conf"), "w") as f:
+            f.write (MENU.format (partuuid = esp["partuuid"]))
+        with open (os.path.join (self.root, "clover.conf"), "w") as f:
+            f.write (CONFIG.format (menu = os.path.join (self.root, "menu.conf"), payload = self.payload,
+                                    boot = self.boot))
+
+        self.settings = {
+            "EFIBootManager": {
+                "FirmwarePath": firmware,
+                "EFIVarsRoot": self.efivars if backend == "native" else missing,
+                "SysFSRoot": sysfs,
+                "UdevDataPath": udev,
+                "MountInfoPath": mountinfo,
+                "CachePath": os.path.join (self.root, "cache", "discovery.json"),
+            },
+            "config": os.path.join (self.root, "clover.conf"),
+            "manifest": os.path.join (self.root, "cache", "menu-manifest.json"),
+            "kernel_cache": os.path.join (self.root, "cache", "kernels.json"),
+        }
+
+    def run (self, action, use_cache):
+        forks = os.path.join (self.root, "forks")
+        trace = os.path.join (self.root, "trace.json")
+        for path in (forks, trace):
+            if os.path.exists (path):
+                os.unlink (path)
+
+        argv = action.split () + ["--loglevel", "error", "--trace-file", trace]
+        if not use_cache:
+            argv.append ("--no-cache")
+        settings = dict (self.settings, argv = argv)
+
+        env = dict (os.environ)
+        env.update ({
+            "PATH": self.bin + os.pathsep + env.get ("PATH", ""),
+            "PYTHONPATH": os.pathsep.join ([ROOT] + [p for p in env.get ("PYTHONPATH", "").split (os.pathsep) if p]),
+            "HOME": self.root,
+            "XDG_CACHE_HOME": os.path.join (self.root, "cache"),
+            "FAKE_NVRAM": self.nvram_path,
+            "FAKE_TOPOLOGY": self.topology_path,
+            "FAKE_EFIVARS": self.efivars if self.backend == "native" else "",
+            "FAKE_FORKS": forks,
+        })
+
+        start = time.perf_counter ()
+        process = subprocess.run ([sys.executable, "-c", DRIVER, json.dumps (settings)], cwd = self.root, env = env,
+                                  stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        latency = time.perf_counter () - start
+
+        fork_counts = {"efibootmgr": 0, "lsblk": 0}
+        if os.path.exists (forks):
+            with open (forks) as f:
+                for line in f:
+                    fork_counts[line.strip ()] = fork_counts.get (line.strip (), 0) + 1
+
+        # spans nest, so only sum up categories whose spans never contain each other
+        categories = {}
+        spans = {}
+        if os.path.exists (trace):
+            with open (trace) as f:
+                for event in json.load (f)["traceEvents"]:
+                    categories[event["cat"]] = categories.get (event["cat"], 0.0) + event["dur"] / 1000
+                    spans[event["name"]] = spans.get (event["name"], 0.0) + event["dur"] / 1000
+
+        return {
+            "exit_code": process.returncode,
+            "latency_ms": latency * 1000,
+            "forks": fork_counts,
+            "parse_ms": categories.get ("parse", 0.0),
+            "discovery_ms": spans.get ("sysfs scan", 0.0) + spans.get ("efivarfs read", 0.0),
+            "spans_ms": spans,
+            "subprocess_ms": categories.get ("subprocess", 0.0),
+            "stderr": process.stderr.decode ()[-2000:] if process.returncode != 0 else "",
+        }
+
+    def cleanup (self):
+        shutil.rmtree (self.root, ignore_errors = True)
+
+def _sizes (value):
+    return [int (size) for size in value.split (",") if size]
+
+def main ():
+    parser = argparse.ArgumentParser (description = "Benchmark the clover-config actions.")
+    parser.add_argument ("--entries", type = _sizes, default = [10, 100, 500],
+                         help = "comma separated numbers of Boot#### entries")
+    parser.add_argument ("--disks", type = _sizes, default = [10, 1000],
+                         help = "comma separated numbers of disks")
+    parser.add_argument ("--partitions", type = int, default = 4, help = "partitions per disk")
+    parser.add_argument ("--esps", type = int, default = 1, help = "mounted EFI partitions on the last disks")
+    parser.add_argument ("--payload-files", type = int, default = 0,
+                         help = "number of files in the Clover payload deployed by install")
+    parser.add_argument ("--kernels", type = int, default = 0,
+                         help = "number of kernels in the scanned kernel directory")
+    parser.add_argument ("--backends", default = "tools,native",
+                         help = "comma separated discovery backends (tools, native)")
+    parser.add_argument ("--output", help = "write the results as JSON to this file")
+    parser.add_argument ("--keep", action = "store_true", help = "keep the generated fixtures")
+    args = parser.parse_args ()
+
+    results = []
+    print ("{:<7} {:>7} {:>6}  {:<20} {:>4} {:>10} {:>6} {:>6} {:>9} {:>12}".format (
+        "backend", "entries", "disks", "action", "exit", "latency ms", "efibm", "lsblk", "parse ms", "discovery ms"))
+    for backend in args.backends.split (","):
+        for entries in args.entries:
+            for disks in args.disks:
+                scenario = Scenario (backend, entries, disks, args.partitions, args.esps, args.payload_files,
+                                     args.kernels)
+                try:
+                    for label, action, use_cache in STEPS:
+                        result = scenario.run (action, use_cache)
+                        result.update (backend = backend, entries = entries, disks = disks,
+                                       partitions = args.partitions, action = label)
+                        results.append (result)
+                        print ("{:<7} {:>7} {:>6}  {:<20} {:>4} {:>10.1f} {:>6} {:>6} {:>9.2f} {:>12.2f}".format (
+                            backend, entries, disks, label, result["exit_code"], result["latency_ms"],
+                            result["forks"]["efibootmgr"], result["forks"]["lsblk"], result["parse_ms"],
+                            result["discovery_ms"]))
+                        if result["stderr"]:
+                            print (result["stderr"], file = sys.stderr)
+                finally:
+                    if args.keep:
+                        print ("fixtures kept in {}".format (scenario.root))
+                    else:
+                        scenario.cleanup ()
+
+    if args.output is not None:
+        with open (args.output, "w") as f:
+            json.dump ({"python": sys.version, "results": results}, f, indent = 2, sort_keys = True)
+
+    sys.exit (1 if any (result["exit_code"] != 0 for result in results) else 0)
+
+if __name__ == "__main__":
+    main ()
@@ -17,9 +17,9 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import argparse
+import sys
 
 from argparse import RawTextHelpFormatter
-from clover_config.actions import Actions
 
 description = """A clover efi bootloader configuration utility.
 
@@ -29,10 +29,20 @@ available actions:
   remove                remove the clover EFI boot entry.
   update                update the boot entries of clover with the
                         configuration given in /etc/clover/menu.conf.
-  efi-check             check if the current system is booted in efi
+  check-efi             check if the current system is booted in efi
                         mode.
+  serve                 answer status queries on a local unix socket
+                        until terminated.
+  watch                 run update whenever the configuration, the menu
+                        or the kernel directories change.
+
+Several actions, e.g. `install update status`, are run in one process
+sharing the discovery of the EFI partitions and the boot entries.
 """
 
+# kept in sync with `clover_config.actions.Actions`, which is too costly to import for parsing the arguments
+ACTIONS = ["status", "install", "remove", "update", "check-efi", "serve", "watch"]
+
 loglevel_help = """set the minimum loglevel a message should have to
 appear on the console. The loglevel for the syslog
 will be `info` regardless of this setting.
@@ -46,19 +56,102 @@ def main ():
         formatter_class = RawTextHelpFormatter
     )
     parser.add_argument (
-        "action", metavar = "ACTION", choices = ["status", "install", "remove", "update", "check-efi"],
-        help = "the action that should be applied on the clover config."
+        "actions", metavar = "ACTION", nargs = "*",
+        help = "the actions that should be applied on the clover config\nin the given order."
+    )
+    parser.add_argument (
+        "-b", "--batch", metavar = "FILE",
+        help = "run the actions listed in FILE, one per line, after\nthe ones given on the command line."
     )
     parser.add_argument (
         "-l", "--loglevel", default = "info", choices = ["debug", "info", "warning", "error"],
         help = loglevel_help
     )
+    parser.add_argument (
+        "-n", "--dry-run", action = "store_true",
+        help = "only print the changes that would be applied to the EFI\nboot configuration."
+    )
+    parser.add_argument (
+        "--no-cache", action = "store_true",
+        help = "ignore and do not write the cached EFI partition\ndiscovery."
+    )
+    parser.add_argument (
+        "--socket", metavar = "PATH",
+        help = "the unix socket of the status daemon. Defaults to\n/run/clover-config.sock when running as root."
+    )
+    parser.add_argument (
+        "--debounce", metavar = "SECONDS", type = float, default = 2.0,
+        help = "seconds without further changes `watch` waits for\nbefore it updates. Defaults to 2."
+    )
+    parser.add_argument (
+        "-f", "--format", default = "text", choices = ["text", "json", "prometheus"],
+        help = "output format of `status`. `prometheus` produces\nnode_exporter textfile metrics."
+    )
+    parser.add_argument (
+        "-o", "--output", metavar = "FILE",
+        help = "write the `status` output to FILE instead of stdout.\n"
+               "FILE is replaced atomically and only if the status\nchanged."
+    )
+    parser.add_argument (
+        "--lock-timeout", metavar = "SECONDS", type = float, default = 30.0,
+        help = "seconds to wait for other clover-config processes\nchanging the boot entries. Defaults to 30."
+    )
+    parser.add_argument (
+        "-t", "--target", metavar = "ROOT", action = "append", dest = "targets",
+        help = "run the actions on the system image or directory tree\n"
+               "mounted at ROOT instead of the running system. Boot\n"
+               "entries are written to an NVRAM manifest in ROOT. May\nbe given several times."
+    )
+    parser.add_argument (
+        "-j", "--jobs", metavar = "N", type = int, default = 1,
+        help = "number of targets processed in parallel. Defaults to 1."
+    )
+    parser.add_argument (
+        "--log-dir", metavar = "DIR",
+        help = "directory for the logs of the targets. Defaults to\nthe current directory."
+    )
+    parser.add_argument (
+        "--profile", action = "store_true",
+        help = "print a summary of the time spent in external commands,\ndiscovery phases and actions."
+    )
+    parser.add_argument (
+        "--trace-file", metavar = "FILE",
+        help = "write a Chrome trace-event file of the run to FILE."
+    )
     parser.add_argument (
         "-v", "--version", action = "version", version = "%(prog)s 0.0.1"
     )
-    args = parser.parse_args ()
+    # options may appear between the actions, e.g. `install -n update`, with python 3.7 and newer
+    args = getattr (parser, "parse_intermixed_args", parser.parse_args) ()
+    if len (args.actions) == 0 and args.batch is None:
+        parser.error ("at least one action or a batch file is required")
+    for action in args.actions:
+        if action not in ACTIONS:
+            parser.error ("argument ACTION: invalid choice: '{}' (choose from {})".format (
+                action, ", ".join ("'{}'".format (name) for name in ACTIONS)
+            ))
+
+    from clover_config.trace import Trace
 
+    if args.profile or args.trace_file is not None:
+        Trace.enable ()
+
+    try:
+        _run (args)
+    finally:
+        if args.profile:
+            print (Trace.format_summary (), file = sys.stderr)
+        if args.trace_file is not None:
+            Trace.write_chrome_trace (args.trace_file)
+
+def _run (args):
     from clover_config.log import Log
+    from clover_config.actions import run_actions
 
     Log.init (args.loglevel)
-    Actions[args.action] ()
+
+    if args.no_cache:
+        from clover_config.efibootmgr import EFIBootManager
+        EFIBootManager.CachePath = None
+
+    run_actions (args.actions, args, args.batch)
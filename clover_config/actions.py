@@ -16,52 +16,214 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
+import sys
+
 from clover_config.log import Log
+from clover_config.api import CloverConfig, MENU_MANIFEST_PATH, KERNEL_CACHE_PATH
 from clover_config.efibootmgr import EFIBootManager
-from clover_config.config import Config
-
-EFI_ENTRY_LABEL = "Clover"
-EFI_ENTRY_LOADER = "/EFI/CLOVER/CLOVERX64.efi"
+from clover_config.errors import CloverConfigError, ConfigError
+from clover_config.lock import LockManager
+from clover_config.paths import get_lock_path, get_socket_path
+from clover_config.trace import Trace
 
-def install ():
-    EFIBootManager.try_remove_boot_entry (EFI_ENTRY_LABEL)
+# The command line actions only report the results of `CloverConfig`
+# operations on the boot manager of the running system.
 
-    if Config.EFIDefault:
-        boot_order = EFIBootManager.get_boot_order ()
+def _clover (args):
+    return CloverConfig (EFIBootManager, manifest = MENU_MANIFEST_PATH, kernel_cache = KERNEL_CACHE_PATH,
+                         lock = LockManager (get_lock_path (), args.lock_timeout))
 
-    EFIBootManager.add_boot_entry (EFI_ENTRY_LABEL, EFI_ENTRY_LOADER)
+def _run_plan (args, operation):
+    try:
+        result = operation (dry_run = args.dry_run)
+    finally:
+        if not args.dry_run:
+            from clover_config.daemon import notify_daemon
+            notify_daemon (args.socket)
 
-    if Config.EFIDefault:
-        bootnum = EFIBootManager.get_bootnum (EFI_ENTRY_LABEL)
-        Log.install.info ("Setting clover as the default EFI boot entry...")
-        if boot_order is None:
-            boot_order = bootnum
+    for payload in result.payload or ():
+        if len (payload.copied) == 0:
+            Log.root.info ("Clover payload on '%s' is already up to date.", payload.destination)
+        elif not payload.written:
+            Log.root.info ("Would copy %d of %d payload files to '%s'.", len (payload.copied), payload.files,
+                           payload.destination)
         else:
-            boot_order = "{},{}".format (bootnum, boot_order)
-        EFIBootManager.set_boot_order (boot_order)
+            Log.root.info ("Copied %d of %d payload files to '%s'.", len (payload.copied), payload.files,
+                           payload.destination)
+
+    if len (result.operations) == 0:
+        Log.root.info ("EFI boot configuration is already up to date.")
+    elif not result.applied:
+        Log.root.info ("The following changes would be applied:")
+        for operation in result.operations:
+            Log.root.info ("  %s", operation)
+
+def install (args):
+    _run_plan (args, _clover (args).install)
+
+def remove (args):
+    _run_plan (args, _clover (args).remove)
+
+def _export (args):
+    from clover_config.export import FORMATS
+    from clover_config.fsutil import write_if_changed
+
+    data = FORMATS[args.format] (_clover (args).report ()).encode ()
+    if args.output is None:
+        sys.stdout.buffer.write (data)
+        sys.stdout.flush ()
+    elif write_if_changed (args.output, data):
+        Log.root.info ("Wrote Clover status to '%s'.", args.output)
+    else:
+        Log.root.debug ("Clover status in '%s' is already up to date.", args.output)
 
-def remove ():
-    EFIBootManager.try_remove_boot_entry (EFI_ENTRY_LABEL)
+def status (args):
+    if args.format != "text":
+        _export (args)
+        return
+    if args.output is not None:
+        raise ConfigError ("Writing the status to a file needs --format json or prometheus")
 
-def status ():
-    bootnum = EFIBootManager.get_bootnum (EFI_ENTRY_LABEL)
-    boot_order = EFIBootManager.get_boot_order ().split (",")
-    active = "active" if EFIBootManager.is_active (EFI_ENTRY_LABEL) else "inactive"
-    if bootnum is None:
+    info = _clover (args).status ()
+    active = "active" if info.active else "inactive"
+    if not info.installed:
         Log.root.info ("Clover is currently NOT installed in your EFI")
+    elif info.position is None:
+        Log.root.info ("Clover is currently installed as Boot%s, which is not in the boot order, and is %s.",
+                       info.bootnum, active)
     else:
-        Log.root.info ("Clover is currently installed at boot position %s and is %s.", boot_order.index (bootnum), active)
+        Log.root.info ("Clover is currently installed at boot position %s and is %s.", info.position, active)
+
+def _report_update (result):
+    for output in result.outputs:
+        if output not in result.changed:
+            Log.update.info ("Clover configuration '%s' is already up to date.", output)
+        elif not result.written:
+            Log.update.info ("Would write %d menu entries to '%s'.", result.entries, output)
+        else:
+            Log.update.info ("Wrote %d menu entries to '%s'.", result.entries, output)
+
+def update (args):
+    _report_update (_clover (args).update (dry_run = args.dry_run))
+
+def check_efi (args):
+    _clover (args).check_efi ()
+
+def serve (args):
+    from clover_config.daemon import StatusDaemon
+
+    StatusDaemon (args.socket or get_socket_path (), _clover (args)).serve_forever ()
 
-def update ():
-    pass
+def watch (args):
+    from clover_config.watch import MenuWatcher
 
-def check_efi ():
-    EFIBootManager.check_efi ()
+    MenuWatcher (_clover (args), args.debounce, dry_run = args.dry_run).run (_report_update)
 
 Actions = {
     "status": status,
     "install": install,
     "remove": remove,
     "update": update,
-    "check-efi": check_efi
+    "check-efi": check_efi,
+    "serve": serve,
+    "watch": watch
 }
+
+# actions that only return when the process is terminated
+BLOCKING_ACTIONS = ("serve", "watch")
+
+def run_action (action, args):
+    with Trace.span (action, "action"):
+        try:
+            Actions[action] (args)
+        except CloverConfigError as e:
+            Log.die (e.exit_code, str (e))
+
+def read_batch (path):
+    """
+    Read the actions of a batch file, one per line. Empty lines and lines
+    starting with `#` are ignored.
+    """
+    try:
+        with open (path) as f:
+            lines = f.read ().splitlines ()
+    except OSError as e:
+        raise ConfigError ("Cannot read batch file '{}': {}".format (path, e.strerror))
+    return [line.strip () for line in lines if line.strip () and not line.strip ().startswith ("#")]
+
+def check_actions (actions, offline = False):
+    for action in actions:
+        if action not in Actions:
+            raise ConfigError ("Unknown action '{}', choose from {}".format (action, ", ".join (Actions)))
+    if offline:
+        from clover_config.offline import OFFLINE_ACTIONS
+
+        for action in actions:
+            if action not in OFFLINE_ACTIONS:
+                raise ConfigError ("The '{}' action is not available for targets, choose from {}".format (
+                    action, ", ".join (OFFLINE_ACTIONS)
+                ))
+    for action in actions[:-1]:
+        if action in BLOCKING_ACTIONS:
+            raise ConfigError ("The '{}' action never returns and has to be the last one".format (action))
+
+def run_actions (actions, args, batch = None):
+    """
+    Run several actions in order and stop at the first one failing.
+
+    All actions use the `EFIBootManager` singleton, so the EFI partition
+    discovery happens once and the boot state read by one action is reused
+    by the next until an action changes the boot entries.
+    """
+    try:
+        if batch is not None:
+            actions = list (actions) + read_batch (batch)
+        check_actions (actions, offline = bool (args.targets))
+    except ConfigError as e:
+        Log.die (e.exit_code, str (e))
+
+    if args.targets:
+        run_offline (actions, args)
+        return
+    for action in actions:
+        run_action (action, args)
+
+def _describe (action, result):
+    if action == "status":
+        return "installed" if result.installed else "not installed"
+    if action == "update":
+        return "{} menu entries, {} of {} outputs changed".format (result.entries, len (result.changed),
+                                                                 len (result.outputs))
+    description = "{} boot entry changes".format (len (result.operations))
+    if result.payload is not None:
+        description += ", {} payload files copied".format (sum (len (payload.copied) for payload in result.payload))
+    return description
+
+def run_offline (actions, args):
+    """
+    Run the actions on every `--target` instead of the running system and
+    report one line per target. The details go to a log per target.
+    """
+    import logging
+
+    from clover_config.offline import run_targets
+
+    log_dir = args.log_dir or "."
+    if not os.path.isdir (log_dir):
+        os.makedirs (log_dir)
+
+    failed = []
+    with Trace.span ("offline", "action"):
+        for result in run_targets (args.targets, actions, args.jobs, args.dry_run, log_dir,
+                                   getattr (logging, args.loglevel.upper ())):
+            if result.error is not None:
+                failed.append (result)
+                Log.root.error ("%s: %s (see '%s')", result.root, result.error, result.log)
+                continue
+            Log.root.info ("%s: %s", result.root, "; ".join (
+                "{} {}".format (action, _describe (action, value)) for action, value in result.results
+            ))
+
+    if failed:
+        Log.die (failed[0].exit_code, "{} of {} targets failed".format (len (failed), len (args.targets)))
@@ -0,0 +1,329 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os.path
+
+from collections import namedtuple
+
+from clover_config.log import Log
+from clover_config.efibootmgr import BootManager
+from clover_config.errors import NoEFIDeviceError, PayloadError, UpdateError
+from clover_config.lock import LockManager
+from clover_config.paths import get_cache_dir, get_lock_path
+
+# Config, the planner and the menu compiler are imported by the operations
+# using them to keep the startup of the remaining ones fast.
+
+EFI_ENTRY_LABEL = "Clover"
+EFI_ENTRY_LOADER = "/EFI/CLOVER/CLOVERX64.efi"
+CLOVER_CONFIG_PATH = os.path.join ("EFI", "CLOVER", "config.plist")
+MENU_MANIFEST_PATH = os.path.join (get_cache_dir (), "menu-manifest.json")
+KERNEL_CACHE_PATH = os.path.join (get_cache_dir (), "kernels.json")
+
+class Status (namedtuple ("Status", ["installed", "bootnum", "position", "active", "boot_order"])):
+    """
+    The state of a boot entry. `position` is the index of the entry in the
+    boot order or None if the firmware does not consider it at all.
+    """
+    __slots__ = ()
+
+class ESPStatus (namedtuple ("ESPStatus", ["device", "mountpoint", "partuuid", "label", "installed", "bootnum",
+                                           "active", "payload_version"])):
+    """
+    The state of an EFI partition: the boot entry registered for it under
+    `label` and the version of the Clover payload on it, if any.
+    """
+    __slots__ = ()
+
+class Report (namedtuple ("Report", ["status", "esps"])):
+    """
+    The `Status` of the boot entry along with an `ESPStatus` per EFI
+    partition.
+    """
+    __slots__ = ()
+
+class PlanResult (namedtuple ("PlanResult", ["operations", "applied", "payload"])):
+    """
+    The boot entry operations that were planned and whether they were
+    applied. `payload` holds the `SyncResult`s of the deployment done along
+    with an install, one per EFI partition, if any.
+    """
+    __slots__ = ()
+
+class UpdateResult (namedtuple ("UpdateResult", ["outputs", "entries", "rendered", "changed", "written"])):
+    """
+    The outcome of compiling the menu. `outputs` are the config.plist files
+    of all EFI partitions and `changed` those that differed from the menu.
+    `entries` is the number of menu entries and `rendered` the titles of
+    those that were not cached.
+    """
+    __slots__ = ()
+
+class CloverConfig:
+    """
+    The clover-config operations for embedding into other programs.
+
+    Each instance keeps its discovery and boot state across calls. Failures
+    raise `CloverConfigError`s carrying the exit code of the equivalent
+    command line invocation. `config` may be any object providing the
+    options of `clover_config.config.SCHEMA` as attributes and defaults to
+    the system configuration. `root` is the root directory of the system
+    whose kernels are put into the menu.
+
+    Other clover-config processes are kept out with `lock`, a `LockManager`
+    on the system wide lock file by default. Reading the boot entries takes
+    it shared, changing them or the config.plist takes it exclusively.
+    """
+
+    def __init__ (self, manager = None, config = None, label = EFI_ENTRY_LABEL, loader = EFI_ENTRY_LOADER,
+                  manifest = MENU_MANIFEST_PATH, kernel_cache = KERNEL_CACHE_PATH, root = "/", lock = None):
+        self.manager = manager if manager is not None else BootManager ()
+        self.label = label
+        self.loader = loader
+        self.manifest = manifest
+        self.kernel_cache = kernel_cache
+        self.root = root
+        self.lock = lock if lock is not None else LockManager (get_lock_path ())
+        self._config = config
+
+    @property
+    def config (self):
+        if self._config is None:
+            from clover_config.config import Config
+            self._config = Config
+        return self._config
+
+    @staticmethod
+    def _status (state, label):
+        entry = state.get (label)
+        if entry is None:
+            return Status (False, None, None, False, state.boot_order)
+        position = state.boot_order.index (entry.bootnum) if entry.bootnum in state.boot_order else None
+        return Status (True, entry.bootnum, position, entry.active, state.boot_order)
+
+    def status (self, label = None):
+        with self.lock.shared ():
+            state = self.manager.get_boot_state ()
+        return self._status (state, label if label is not None else self.label)
+
+    def report (self):
+        """
+        Like `status`, but also describe every EFI partition including the
+        version of the payload deployed to it.
+        """
+        from clover_config.payload import get_payload_version
+
+        with self.lock.shared ():
+            state = self.manager.get_boot_state ()
+        esps = []
+        for esp in self.manager.get_esps ():
+            label = self.get_label (esp)
+            entry = state.get (label)
+            esps.append (ESPStatus (
+                esp.device, esp.mountpoint, esp.partuuid, label, entry is not None,
+                entry.bootnum if entry is not None else None, entry is not None and entry.active,
+                get_payload_version (esp.mountpoint)
+            ))
+        return Report (self._status (state, self.label), tuple (esps))
+
+    def get_label (self, esp):
+        """
+        The boot entry label for an EFI partition. Additional partitions are
+        told apart by their partition UUID as their device names may change.
+        """
+        from clover_config.plan import mirror_label
+
+        esps = self.manager.get_esps ()
+        if esp == esps[0]:
+            return self.label
+        identifier = esp.partuuid if esp.partuuid else os.path.basename (esp.device)
+        return mirror_label (self.label, identifier)
+
+    def plan_install (self):
+        from clover_config.plan import DesiredEntry, plan_install_all
+
+        state = self.manager.get_boot_state ()
+        desired = [
+            DesiredEntry (self.get_label (esp), self.loader, esp.disk, esp.partition, esp.partuuid,
+                          self.config.EFIDefault)
+            for esp in self.manager.get_esps ()
+        ]
+        return plan_install_all (state, desired, self.manager.entry_matches)
+
+    def plan_remove (self):
+        from clover_config.plan import plan_remove
+
+        try:
+            known = [self.get_label (esp) for esp in self.manager.get_esps ()]
+        except NoEFIDeviceError:
+            # the entries of partitions no longer mounted are still told by their partition UUID
+            known = []
+        return plan_remove (self.manager.read_boot_state (), self.label, known)
+
+    def _locked (self, dry_run):
+        # dry runs only read, so they do not keep others from reading
+        return self.lock.shared () if dry_run else self.lock.exclusive ()
+
+    def _apply (self, operations, dry_run, payload = None):
+        if len (operations) == 0 or dry_run:
+            return PlanResult (tuple (operations), False, payload)
+        self.manager.apply (operations)
+        return PlanResult (tuple (operations), True, payload)
+
+    def deploy (self, dry_run = False):
+        """
+        Copy the Clover payload onto every EFI partition concurrently and
+        return a `SyncResult` per partition. Returns None if there is no
+        payload to deploy.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        from clover_config.payload import PayloadSync
+
+        source = self.config.PayloadDir
+        if not os.path.isdir (source):
+            Log.payload.warning ("No Clover payload found at '%s', assuming it is already on the EFI partition.",
+                                 source)
+            return None
+
+        def sync (esp):
+            try:
+                return PayloadSync (source, esp.mountpoint, exclude = (CLOVER_CONFIG_PATH,)).sync (dry_run)
+            except OSError as e:
+                raise PayloadError ("Deploying the Clover payload to '{}' failed: {}".format (esp.mountpoint, e))
+
+        esps = self.manager.get_esps ()
+        # leaving the executor waits for all partitions, even if one of them failed
+        with ThreadPoolExecutor (max_workers = len (esps)) as executor:
+            futures = [executor.submit (sync, esp) for esp in esps]
+        return tuple (future.result () for future in futures)
+
+    def install (self, dry_run = False):
+        from clover_config.plan import CREATE
+
+        # the loader has to be in place before the firmware is pointed at it. Copying
+        # it does not need the lock as every file is replaced atomically.
+        payload = self.deploy (dry_run)
+        with self._locked (dry_run):
+            # the boot entries may have changed since they were last read without the lock
+            self.manager.invalidate ()
+            result = self._apply (self.plan_install (), dry_run, payload)
+
+            # entries created next to existing ones may need another pass to get the boot order right
+            if result.applied and any (operation.kind == CREATE for operation in result.operations):
+                operations = self.plan_install ()
+                if len (operations) > 0:
+                    self.manager.apply (operations)
+                    result = result._replace (operations = result.operations + tuple (operations))
+        return result
+
+    def remove (self, dry_run = False):
+        with self._locked (dry_run):
+            self.manager.invalidate ()
+            return self._apply (self.plan_remove (), dry_run)
+
+    def get_kernel_entries (self, menu):
+        """
+        Menu entries for the kernels found in the `KernelDirs`, except for
+        those `menu` already boots or whose title it already uses.
+        """
+        from clover_config.kernels import KernelScanner, get_kernel_options, get_menu_entries
+        from clover_config.plan import normalize_loader
+
+        kernels = KernelScanner (self.config.KernelDirs, self.kernel_cache).scan ()
+        if len (kernels) == 0:
+            return []
+
+        titles = {entry.title for entry in menu.entries}
+        paths = {normalize_loader (dict (entry.options)["path"]) for entry in menu.entries
+                 if "path" in dict (entry.options)}
+        entries = []
+        for entry in get_menu_entries (kernels, get_kernel_options (self.config.KernelOptions, self.root),
+                                       self.manager.get_device_tree (), self.root):
+            path = normalize_loader (dict (entry.options)["path"])
+            if entry.title not in titles and path not in paths:
+                titles.add (entry.title)
+                entries.append (entry)
+        return entries
+
+    def _read_config (self, output):
+        # a new EFI partition starts out with the config.plist shipped with the payload
+        for path in (output, os.path.join (self.config.PayloadDir, CLOVER_CONFIG_PATH)):
+            try:
+                with open (path, "rb") as f:
+                    return f.read ()
+            except FileNotFoundError:
+                continue
+        return None
+
+    def _update_output (self, compiler, menu, output, dry_run):
+        """
+        Compile the menu into the config.plist at `output` and write it if
+        it changed. Returns the titles of the rendered entries and whether
+        the config.plist changed.
+        """
+        # every EFI partition keeps its own settings, only the menu is merged into them
+        data, titles = compiler.compile (menu, self._read_config (output))
+        up_to_date = compiler.is_up_to_date (output, data)
+        # a dry run leaves the menu manifest alone as well
+        if not dry_run and up_to_date:
+            compiler.record_output (output, data)
+        elif not dry_run:
+            compiler.write (output, data)
+        return titles, not up_to_date
+
+    def update (self, dry_run = False):
+        from clover_config.menu import Menu, MenuCompiler, MenuError, load_menu
+
+        menu_file = self.config.MenuFile
+        try:
+            menu = load_menu (menu_file)
+            if menu is None:
+                if not self.config.ScanKernels:
+                    Log.update.warning ("No menu configuration found at '%s', generating an empty menu.", menu_file)
+                menu = Menu ({}, [])
+            if self.config.ScanKernels:
+                menu = menu._replace (entries = menu.entries + self.get_kernel_entries (menu))
+
+        except MenuError as e:
+            raise MenuError ("Invalid menu configuration: {}".format (e))
+
+        compiler = MenuCompiler (self.manifest)
+        outputs = [os.path.join (esp.mountpoint, CLOVER_CONFIG_PATH) for esp in self.manager.get_esps ()]
+        changed = []
+        rendered = []
+        with self._locked (dry_run):
+            for output in outputs:
+                try:
+                    titles, output_changed = self._update_output (compiler, menu, output, dry_run)
+                except MenuError as e:
+                    raise MenuError ("Cannot update '{}': {}".format (output, e))
+                except OSError as e:
+                    # e.g. a read-only or full EFI partition
+                    raise UpdateError ("Cannot update '{}': {}".format (output, e))
+                rendered.extend (title for title in titles if title not in rendered)
+                if output_changed:
+                    changed.append (output)
+
+        Log.update.debug ("Rendered %d of %d menu entries", len (rendered), len (menu.entries))
+        return UpdateResult (tuple (outputs), len (menu.entries), rendered, tuple (changed),
+                             not dry_run and len (changed) > 0)
+
+    def check_efi (self):
+        with self.lock.shared ():
+            self.manager.check_efi ()
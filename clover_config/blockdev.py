@@ -0,0 +1,100 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import namedtuple
+
+ESP_PARTTYPE = "c12a7328-f81f-11d2-ba4b-00a0c93ec93b"
+ESP_FSTYPE = "vfat"
+
+class Mount (namedtuple ("Mount", ["mountpoint", "fstype", "source"])):
+    __slots__ = ()
+
+class Partition (namedtuple ("Partition", ["name", "device", "disk", "number", "devno",
+                                           "parttype", "partuuid", "fstype", "mounts"])):
+    __slots__ = ()
+
+    @property
+    def mountpoint (self):
+        return self.mounts[0].mountpoint if self.mounts else None
+
+    def is_esp (self):
+        return (self.parttype is not None and self.parttype.lower () == ESP_PARTTYPE and
+                self.fstype == ESP_FSTYPE and self.mountpoint is not None)
+
+class Disk (namedtuple ("Disk", ["name", "device", "devno", "partitions"])):
+    __slots__ = ()
+
+class ESP (namedtuple ("ESP", ["device", "disk", "partition", "mountpoint", "partuuid"])):
+    """
+    A mounted EFI system partition as needed to register boot entries on
+    it. `disk` is the device of its disk and `partition` its number.
+    """
+    __slots__ = ()
+
+class DeviceTree:
+    """
+    An index over all block devices of the system, built by a single
+    discovery pass. Disks hold their partitions and partitions hold their
+    mounts.
+    """
+
+    def __init__ (self, disks):
+        self.disks = {}
+        self.partitions = {}
+        self._by_device = {}
+        for disk in disks:
+            self.disks[disk.name] = disk
+            self._by_device[disk.device] = disk
+            for part in disk.partitions:
+                self.partitions[part.name] = part
+                self._by_device[part.device] = part
+
+    @staticmethod
+    def build (disks, partitions):
+        """
+        Assemble a tree from a list of `Disk`s without partitions and a list
+        of `Partition`s referring to their disk by name.
+        """
+        children = {}
+        for part in partitions:
+            children.setdefault (part.disk, []).append (part)
+
+        return DeviceTree (
+            disk._replace (partitions = tuple (sorted (children.get (disk.name, ()), key = lambda p: p.number)))
+            for disk in disks
+        )
+
+    def get (self, device):
+        return self._by_device.get (device)
+
+    def get_disk (self, partition):
+        return self.disks.get (partition.disk)
+
+    def get_by_mountpoint (self, mountpoint):
+        for part in self.partitions.values ():
+            if any (mount.mountpoint == mountpoint for mount in part.mounts):
+                return part
+        return None
+
+    def find_esps (self):
+        return [part for disk in sorted (self.disks.values (), key = lambda d: d.name)
+                for part in disk.partitions if part.is_esp ()]
+
+    def get_esps (self):
+        return [ESP (part.device, self.get_disk (part).device, str (part.number), part.mountpoint, part.partuuid)
+                for part in self.find_esps ()]
@@ -0,0 +1,97 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+
+from collections import namedtuple
+from types import MappingProxyType
+
+# only compiled when efibootmgr output actually has to be parsed
+BOOT_ENTRY_REGEX = r"^Boot([0-9A-Fa-f]{4})(\*?)\s+([^\t]*?)\s*(?:\t(.*))?$"
+BOOT_CURRENT_REGEX = r"^BootCurrent:\s*([0-9A-Fa-f]{4})\s*$"
+BOOT_ORDER_REGEX = r"^BootOrder:\s*(.*?)\s*$"
+TIMEOUT_REGEX = r"^Timeout:\s*(\d+)"
+
+class BootEntry (namedtuple ("BootEntry", ["bootnum", "label", "active", "device_path"])):
+    __slots__ = ()
+
+class BootState (namedtuple ("BootState", ["entries", "labels", "boot_order", "timeout", "current"])):
+    """
+    An immutable snapshot of the EFI boot manager variables.
+
+    `entries` maps bootnums to `BootEntry`s, `labels` maps labels to the first
+    `BootEntry` carrying that label and `boot_order` is a tuple of bootnums.
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def from_entries (entries, boot_order = (), timeout = None, current = None):
+        by_bootnum = {}
+        by_label = {}
+        for entry in entries:
+            by_bootnum[entry.bootnum] = entry
+            by_label.setdefault (entry.label, entry)
+
+        return BootState (
+            MappingProxyType (by_bootnum), MappingProxyType (by_label),
+            tuple (boot_order), timeout, current
+        )
+
+    @staticmethod
+    def parse (output):
+        entries = []
+        boot_order = ()
+        timeout = None
+        current = None
+        entry_regex = re.compile (BOOT_ENTRY_REGEX)
+        boot_order_regex = re.compile (BOOT_ORDER_REGEX)
+        boot_current_regex = re.compile (BOOT_CURRENT_REGEX)
+        timeout_regex = re.compile (TIMEOUT_REGEX)
+
+        for line in output.splitlines ():
+            m = entry_regex.match (line)
+            if m is not None:
+                entries.append (BootEntry (m.group (1).upper (), m.group (3), m.group (2) == "*", m.group (4)))
+                continue
+
+            m = boot_order_regex.match (line)
+            if m is not None:
+                boot_order = tuple (num.upper () for num in m.group (1).split (",") if num)
+                continue
+
+            m = boot_current_regex.match (line)
+            if m is not None:
+                current = m.group (1).upper ()
+                continue
+
+            m = timeout_regex.match (line)
+            if m is not None:
+                timeout = int (m.group (1))
+
+        return BootState.from_entries (entries, boot_order, timeout, current)
+
+    def get (self, label):
+        return self.labels.get (label)
+
+    def get_bootnum (self, label):
+        entry = self.labels.get (label)
+        return entry.bootnum if entry is not None else None
+
+    def is_active (self, label):
+        entry = self.labels.get (label)
+        return entry is not None and entry.active
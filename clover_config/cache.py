@@ -0,0 +1,76 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import json
+import os
+import os.path
+
+from clover_config.paths import BOOT_ID_PATH
+
+CACHE_VERSION = 1
+
+class DiscoveryCache:
+    """
+    Persist the result of the EFI partition discovery across invocations.
+
+    An entry is only valid for the boot it was created in and as long as
+    the mount table did not change, which is cheap to verify and covers
+    every event that could move the EFI partition.
+    """
+
+    def __init__ (self, path, mountinfo, boot_id = BOOT_ID_PATH, scope = ()):
+        self.path = path
+        self.mountinfo = mountinfo
+        self.boot_id = boot_id
+        self.scope = scope
+
+    def key (self):
+        digest = hashlib.sha256 ()
+        digest.update (str (CACHE_VERSION).encode ())
+        for part in self.scope:
+            digest.update (b"\0" + str (part).encode ())
+        for path in (self.boot_id, self.mountinfo):
+            with open (path, "rb") as f:
+                digest.update (b"\0" + f.read ())
+        return digest.hexdigest ()
+
+    def load (self):
+        try:
+            with open (self.path) as f:
+                content = json.load (f)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance (content, dict) or content.get ("key") != self.key ():
+            return None
+        return content.get ("values")
+
+    def store (self, values):
+        from clover_config.fsutil import atomic_write
+
+        directory = os.path.dirname (self.path)
+        if not os.path.isdir (directory):
+            os.makedirs (directory)
+        atomic_write (self.path, json.dumps ({"key": self.key (), "values": values}).encode ())
+
+    def clear (self):
+        try:
+            os.unlink (self.path)
+        except FileNotFoundError:
+            pass
@@ -16,9 +16,172 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-class Config:
-    EFIDefault = False
+import json
+import os
+import os.path
 
-    def __init__ (self):
-        # TODO: load config from file
-        pass
+from collections import OrderedDict
+
+from clover_config.log import Log
+from clover_config.errors import ConfigError
+from clover_config.paths import get_cache_dir
+
+CONFIG_PATH = "/etc/clover/clover.conf"
+CONFIG_SECTION = "clover"
+CACHE_VERSION = 1
+
+def _parse_bool (value):
+    states = {"1": True, "yes": True, "true": True, "on": True,
+              "0": False, "no": False, "false": False, "off": False}
+    if value.lower () not in states:
+        raise ValueError ("not a boolean")
+    return states[value.lower ()]
+
+def _parse_str (value):
+    return value
+
+def _parse_paths (value):
+    return value.split ()
+
+# option name -> (parser, default)
+SCHEMA = OrderedDict ([
+    ("EFIDefault", (_parse_bool, False)),
+    ("MenuFile", (_parse_str, "/etc/clover/menu.conf")),
+    ("PayloadDir", (_parse_str, "/usr/lib/clover")),
+    ("KernelDirs", (_parse_paths, ["/boot"])),
+    ("ScanKernels", (_parse_bool, True)),
+    ("KernelOptions", (_parse_str, "")),
+])
+
+def get_config_files (path = CONFIG_PATH):
+    """
+    Return the main configuration file followed by the drop-in files of
+    `<path>.d/` in lexical order. Later files override earlier ones.
+    """
+    files = [path]
+    dropin = path + ".d"
+    try:
+        names = sorted (name for name in os.listdir (dropin) if name.endswith (".conf"))
+    except (FileNotFoundError, NotADirectoryError):
+        names = []
+    files.extend (os.path.join (dropin, name) for name in names)
+    return files
+
+def _fingerprint (path):
+    files = get_config_files (path)
+    fingerprint = []
+    for file in files + [path + ".d"]:
+        try:
+            stat = os.stat (file)
+            fingerprint.append ([file, stat.st_mtime_ns, stat.st_size])
+        except FileNotFoundError:
+            fingerprint.append ([file, None, None])
+    return files, fingerprint
+
+def parse_config (files):
+    import configparser
+
+    options = {name.lower (): name for name in SCHEMA}
+    values = OrderedDict ((name, default) for name, (_, default) in SCHEMA.items ())
+    for file in files:
+        parser = configparser.RawConfigParser (interpolation = None)
+        try:
+            if not parser.read (file):
+                continue
+        except configparser.Error as e:
+            raise ConfigError (str (e))
+
+        for section in parser.sections ():
+            if section != CONFIG_SECTION:
+                raise ConfigError ("Unknown section '{}' in {}".format (section, file))
+
+            for key, value in parser.items (section):
+                if key not in options:
+                    raise ConfigError ("Unknown option '{}' in {}".format (key, file))
+                name = options[key]
+                try:
+                    values[name] = SCHEMA[name][0] (value)
+                except ValueError as e:
+                    raise ConfigError ("Invalid value '{}' for option '{}' in {}: {}".format (value, name, file, e))
+    return values
+
+class ConfigLoader:
+    """
+    Load the layered configuration and cache the validated result keyed on
+    the modification times and sizes of all contributing files.
+    """
+
+    def __init__ (self, path = CONFIG_PATH, cache = None):
+        self.path = path
+        self.cache = cache
+
+    def _load_cache (self, fingerprint):
+        try:
+            with open (self.cache) as f:
+                content = json.load (f)
+        except (OSError, ValueError):
+            return None
+        if (not isinstance (content, dict) or content.get ("version") != CACHE_VERSION or
+                content.get ("fingerprint") != fingerprint):
+            return None
+        values = content.get ("values")
+        if not isinstance (values, dict) or set (values) != set (SCHEMA):
+            return None
+        return values
+
+    def _store_cache (self, fingerprint, values):
+        from clover_config.fsutil import atomic_write
+
+        directory = os.path.dirname (self.cache)
+        if not os.path.isdir (directory):
+            os.makedirs (directory)
+        content = {"version": CACHE_VERSION, "fingerprint": fingerprint, "values": values}
+        atomic_write (self.cache, json.dumps (content).encode ())
+
+    def load (self):
+        files, fingerprint = _fingerprint (self.path)
+        if self.cache is not None:
+            values = self._load_cache (fingerprint)
+            if values is not None:
+                return values
+
+        values = parse_config (files)
+        if self.cache is not None:
+            try:
+                self._store_cache (fingerprint, values)
+            except OSError:
+                pass
+        return values
+
+class _LazyConfig (type):
+    def __getattr__ (cls, name):
+        if name not in SCHEMA:
+            raise AttributeError (name)
+        cls.load ()
+        return cls.__dict__[name]
+
+class Config (metaclass = _LazyConfig):
+    """
+    The clover-config settings. Options are loaded from the configuration
+    files on first access, so code paths that never look at them never
+    touch the disk.
+    """
+    Path = CONFIG_PATH
+    CachePath = os.path.join (get_cache_dir (), "config.json")
+
+    @classmethod
+    def load (cls):
+        Log.config.debug ("Loading configuration from '%s'", cls.Path)
+        try:
+            values = ConfigLoader (cls.Path, cls.CachePath).load ()
+        except ConfigError as e:
+            raise ConfigError ("Invalid configuration: {}".format (e))
+
+        for name, value in values.items ():
+            setattr (cls, name, value)
+
+    @classmethod
+    def reset (cls):
+        for name in SCHEMA:
+            if name in cls.__dict__:
+                delattr (cls, name)
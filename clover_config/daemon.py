@@ -0,0 +1,291 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+import os.path
+import select
+import signal
+import socket
+import struct
+import sys
+import time
+
+from clover_config.log import Log
+from clover_config.errors import CloverConfigError, DaemonError
+from clover_config.exit_code import ExitCode
+from clover_config.paths import get_socket_path
+
+QUERIES = ("status", "bootnum", "boot-order", "active", "invalidate")
+
+# seconds a client may take to send its request or to read the response
+CLIENT_TIMEOUT = 1.0
+# seconds a mutating action waits for the daemon to acknowledge a notification
+NOTIFY_TIMEOUT = 0.5
+MAX_REQUEST_SIZE = 4096
+# seconds after which the boot state is re-read if efivarfs cannot be watched
+FALLBACK_REFRESH_INTERVAL = 60
+
+def _read_line (connection):
+    data = b""
+    while b"\n" not in data:
+        chunk = connection.recv (MAX_REQUEST_SIZE)
+        if not chunk:
+            break
+        data += chunk
+        if len (data) > MAX_REQUEST_SIZE:
+            raise ValueError ("request too large")
+    return data.split (b"\n", 1)[0]
+
+def _get_peer_uid (connection):
+    """
+    The user id of the process at the other end of a Unix socket, or None
+    if the platform does not tell.
+    """
+    if not hasattr (socket, "SO_PEERCRED"):
+        return None
+    try:
+        credentials = connection.getsockopt (socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize ("3i"))
+    except OSError:
+        return None
+    _, uid, _ = struct.unpack ("3i", credentials)
+    return uid
+
+def _send_request (path, request, timeout):
+    client = socket.socket (socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout (timeout)
+    try:
+        client.connect (path)
+        client.sendall (json.dumps (request).encode () + b"\n")
+        return json.loads (_read_line (client).decode ())
+    finally:
+        client.close ()
+
+def query (name, label = None, path = None, timeout = CLIENT_TIMEOUT):
+    """
+    Send a query to a running daemon and return its JSON response. Raises
+    `OSError` if no daemon is listening.
+    """
+    request = {"query": name}
+    if label is not None:
+        request["label"] = label
+    return _send_request (path or get_socket_path (), request, timeout)
+
+def notify_daemon (path = None):
+    """
+    Tell a running daemon that the boot configuration changed. Does nothing
+    if no daemon is listening.
+    """
+    path = path or get_socket_path ()
+    if not os.path.exists (path):
+        return
+    try:
+        _send_request (path, {"query": "invalidate"}, NOTIFY_TIMEOUT)
+    except (OSError, ValueError) as e:
+        Log.daemon.debug ("Could not notify status daemon at '%s': %s", path, e)
+
+def _terminate (signum, frame):
+    sys.exit (ExitCode.SUCCESS.value)
+
+class StatusDaemon:
+    """
+    Answer status queries on a Unix socket from the boot state and EFI
+    partition discovery kept in memory.
+
+    The boot state is dropped when efivarfs reports a change through
+    inotify or a client sends an `invalidate` query, the discovery when the
+    kernel signals a change of the mount table. Both are re-read lazily by
+    the next query.
+    """
+
+    def __init__ (self, path, clover):
+        self.path = path
+        self.clover = clover
+        self._server = None
+        self._inotify = None
+        self._mountinfo = None
+        self._loaded = None
+
+    def _bind (self):
+        if os.path.exists (self.path):
+            probe = socket.socket (socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect (self.path)
+            except OSError:
+                # nobody is listening, the socket was left behind by a crashed daemon
+                os.unlink (self.path)
+            else:
+                raise DaemonError ("Another daemon is already listening on '{}'".format (self.path))
+            finally:
+                probe.close ()
+
+        directory = os.path.dirname (self.path)
+        if not os.path.isdir (directory):
+            os.makedirs (directory)
+
+        self._server = socket.socket (socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind (self.path)
+        # queries are read-only, so everybody may connect, `invalidate` is checked per client
+        os.chmod (self.path, 0o666)
+        self._server.listen (16)
+        self._server.setblocking (False)
+
+    def _watch_efivars (self):
+        from clover_config.inotify import Inotify
+
+        try:
+            self._inotify = Inotify ()
+            self._inotify.add_watch (self.clover.manager.EFIVarsRoot)
+        except OSError as e:
+            Log.daemon.warning ("Cannot watch '%s' for changes (%s), re-reading the boot state every %d seconds",
+                                self.clover.manager.EFIVarsRoot, e, FALLBACK_REFRESH_INTERVAL)
+            if self._inotify is not None:
+                self._inotify.close ()
+            self._inotify = None
+
+    def _watch_mountinfo (self):
+        try:
+            self._mountinfo = open (self.clover.manager.MountInfoPath, "rb")
+            self._mountinfo.read ()
+        except OSError as e:
+            Log.daemon.warning ("Cannot watch '%s' for changes: %s", self.clover.manager.MountInfoPath, e)
+            self._mountinfo = None
+
+    def invalidate (self):
+        Log.daemon.debug ("Boot configuration changed, dropping the boot state")
+        self.clover.manager.invalidate ()
+
+    def _on_mount_change (self):
+        # the kernel keeps signalling until the table was read again
+        self._mountinfo.seek (0)
+        self._mountinfo.read ()
+        Log.daemon.debug ("Mount table changed, dropping the EFI partition discovery")
+        self.clover.manager.reset ()
+
+    def get_status (self, label = None):
+        if self._inotify is None and (self._loaded is None or
+                                      time.monotonic () - self._loaded > FALLBACK_REFRESH_INTERVAL):
+            self.clover.manager.invalidate ()
+            self._loaded = time.monotonic ()
+        return self.clover.status (label)
+
+    def handle (self, request, uid = None):
+        """
+        Answer a request of a client running as `uid`. Only root may
+        invalidate the boot state, as re-reading it on behalf of everybody
+        would be an easy way to keep us busy.
+        """
+        if not isinstance (request, dict):
+            return {"error": "Request is not a JSON object"}
+        name = request.get ("query")
+        label = request.get ("label", self.clover.label)
+        if name not in QUERIES:
+            return {"error": "Unknown query '{}'".format (name)}
+        if not isinstance (label, str):
+            return {"error": "Label is not a string"}
+
+        if name == "invalidate":
+            if uid != 0:
+                return {"error": "Only root may invalidate the boot state"}
+            self.invalidate ()
+            return {"result": None}
+
+        try:
+            status = self.get_status (label)
+        except CloverConfigError as e:
+            return {"error": str (e), "exit_code": e.exit_code.value}
+
+        results = {
+            "status": status._asdict (),
+            "bootnum": status.bootnum,
+            "boot-order": status.boot_order,
+            "active": status.active,
+        }
+        return {"result": results[name]}
+
+    def _accept (self):
+        try:
+            connection, _ = self._server.accept ()
+        except BlockingIOError:
+            return
+
+        with connection:
+            connection.settimeout (CLIENT_TIMEOUT)
+            try:
+                request = _read_line (connection)
+            except (OSError, ValueError) as e:
+                Log.daemon.debug ("Dropping client: %s", e)
+                return
+            if not request:
+                return
+
+            try:
+                response = self.handle (json.loads (request.decode ()), _get_peer_uid (connection))
+            except ValueError as e:
+                response = {"error": "Invalid request: {}".format (e)}
+
+            try:
+                connection.sendall (json.dumps (response).encode () + b"\n")
+            except OSError as e:
+                Log.daemon.debug ("Could not answer client: %s", e)
+
+    def serve_forever (self):
+        self._bind ()
+        signal.signal (signal.SIGTERM, _terminate)
+        try:
+            self._watch_efivars ()
+            self._watch_mountinfo ()
+
+            poller = select.poll ()
+            poller.register (self._server, select.POLLIN)
+            if self._inotify is not None:
+                poller.register (self._inotify, select.POLLIN)
+            if self._mountinfo is not None:
+                poller.register (self._mountinfo, select.POLLPRI | select.POLLERR)
+
+            # watches are set up first so no change between reading and watching is missed
+            self.get_status ()
+            Log.daemon.info ("Answering status queries on '%s'", self.path)
+            while True:
+                for fd, _ in poller.poll ():
+                    if fd == self._server.fileno ():
+                        self._accept ()
+                    elif self._inotify is not None and fd == self._inotify.fileno ():
+                        if self._inotify.read ():
+                            self.invalidate ()
+                    elif self._mountinfo is not None and fd == self._mountinfo.fileno ():
+                        self._on_mount_change ()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close ()
+
+    def close (self):
+        if self._server is not None:
+            self._server.close ()
+            self._server = None
+            try:
+                os.unlink (self.path)
+            except FileNotFoundError:
+                pass
+        if self._inotify is not None:
+            self._inotify.close ()
+            self._inotify = None
+        if self._mountinfo is not None:
+            self._mountinfo.close ()
+            self._mountinfo = None
@@ -16,119 +16,348 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import subprocess
-import re
 import os.path
 
 from clover_config.log import Log
-from clover_config.exit_code import ExitCode
-from clover_config.lsblk import LsBlk
+from clover_config.errors import EFIBootManagerError, ExecutableNotFoundError, NoEFIDeviceError, NotInEFIModeError
+from clover_config.trace import Trace
+from clover_config.paths import (EFI_FIRMWARE_PATH, EFIVARS_PATH, SYSFS_PATH, MOUNTINFO_PATH, UDEV_DATA_PATH,
+                                 get_cache_dir)
+
+# The discovery backends and subprocess handling are imported where they are
+# used, so cheap actions like check-efi do not pay for loading them.
+
+# attributes of BootManager describing the primary EFI partition, taken from the first entry of `ESPs`
+DISCOVERY_FIELDS = ("Device", "Disk", "Partition", "Mountpoint", "PartUUID")
+
+DISCOVERY_CACHE_PATH = os.path.join (get_cache_dir (), "discovery.json")
+
+# parameters that only query the boot manager and leave the NVRAM untouched
+READ_ONLY_PARAMETERS = {"-v", "--verbose", "-q", "--quiet"}
+
+async def efibootmgr_async (*parameters, check = True):
+    """
+    Run efibootmgr and return its output. Raises `EFIBootManagerError` if
+    it fails and `check` is set.
+    """
+    from clover_config.runner import run_command
 
-def efibootmgr (*parameters, die_on_failure = True):
     Log.efibootmgr.debug ("Calling subprocess: efibootmgr %s", " ".join (parameters))
     try:
-        process = subprocess.Popen (["efibootmgr"] + list (parameters),
-                                    stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        result = await run_command ("efibootmgr", *parameters)
     except FileNotFoundError:
-        Log.die (ExitCode.NOT_ROOT, "Executable 'efibootmgr' not found in PATH! Try running this program "
-                 "as root or install the package containing this executable with your distributions package manager")
-
-    out, err = process.communicate ()
+        raise ExecutableNotFoundError ("efibootmgr")
 
-    Log.efibootmgr.debug ("Subprocess efibootmgr exited with exit code %d", process.returncode)
+    Log.efibootmgr.debug ("Subprocess efibootmgr exited with exit code %d", result.returncode)
 
-    if len (err) > 0:
-        Log.efibootmgr.error (err.decode ())
+    if len (result.err) > 0:
+        Log.efibootmgr.error (result.err.decode ())
 
-    if die_on_failure and process.returncode != 0:
+    if check and result.returncode != 0:
         Log.efibootmgr.error ("An error occured while configuring your EFI setup!")
         Log.efibootmgr.error ("Please check your EFI configuration manually with `efibootmgr`.")
         Log.efibootmgr.error ("This error might have damaged existing boot configurations!")
-        Log.die (ExitCode.EFIBOOTMGR_ERROR, "Error while configuring EFI boot!")
+        raise EFIBootManagerError ("Error while configuring EFI boot!")
 
-    return out.decode ()
+    return result.out.decode ()
 
-class EFIBootManager:
-    Device = None
-    Disk = None
-    Partition = None
-    Mountpoint = None
-    _initialized = False
+def efibootmgr (*parameters, check = True):
+    from clover_config.runner import run
 
-    @staticmethod
-    def _initialize ():
-        if EFIBootManager._initialized:
+    return run (efibootmgr_async (*parameters, check = check))
+
+class BootManager:
+    """
+    The EFI boot entries and the EFI partition of one system.
+
+    All mounted EFI partitions are discovered on first use, the first one
+    being the primary partition, and the boot entries are read once and
+    kept until they are modified through this object or `invalidate` is
+    called. Failures raise `CloverConfigError`s.
+    """
+
+    def __init__ (self, firmware = EFI_FIRMWARE_PATH, efivars = EFIVARS_PATH, sysfs = SYSFS_PATH,
+                  mountinfo = MOUNTINFO_PATH, udev = UDEV_DATA_PATH, cache = DISCOVERY_CACHE_PATH):
+        self.Device = None
+        self.Disk = None
+        self.Partition = None
+        self.Mountpoint = None
+        self.PartUUID = None
+        self.ESPs = ()
+        self.FirmwarePath = firmware
+        self.EFIVarsRoot = efivars
+        self.SysFSRoot = sysfs
+        self.MountInfoPath = mountinfo
+        self.UdevDataPath = udev
+        self.CachePath = cache
+        self._initialized = False
+        self._boot_state = None
+        self._device_tree = None
+
+    async def _efibootmgr_async (self, *parameters, check = True):
+        try:
+            return await efibootmgr_async (*parameters, check = check)
+        finally:
+            if not READ_ONLY_PARAMETERS.issuperset (parameters):
+                self.invalidate ()
+
+    def _efibootmgr (self, *parameters, check = True):
+        from clover_config.runner import run
+
+        return run (self._efibootmgr_async (*parameters, check = check))
+
+    def _initialize (self, prefetch_boot_state = False):
+        if self._initialized:
             return
 
-        EFIBootManager.check_efi ()
+        cache = self._get_discovery_cache ()
+        if cache is not None:
+            with Trace.span ("load discovery cache", "discovery"):
+                cached = self._load_discovery (cache)
+            if cached:
+                self._initialized = True
+                return
+
+        with Trace.span ("check efi", "discovery"):
+            self.check_efi ()
 
         Log.efibootmgr.info ("Checking for a mounted EFI partition...")
-        EFIBootManager.Device = LsBlk.get_efi_device ()
+        if prefetch_boot_state and self._boot_state is None:
+            from clover_config.runner import run_concurrently
+
+            # the block device scan and the NVRAM read are independent of each other
+            with Trace.span ("device discovery and boot state", "discovery"):
+                _, self._boot_state = run_concurrently (
+                    self.get_device_tree_async (), self._read_boot_state_async ()
+                )
+        else:
+            with Trace.span ("device discovery", "discovery"):
+                self.get_device_tree ()
+        esps = self._device_tree.get_esps ()
+
+        if len (esps) == 0:
+            raise NoEFIDeviceError ("No mounted EFI partition found")
+
+        self._use_esps (esps)
+        for esp in esps:
+            Log.efibootmgr.debug ("EFI device is '%s' (partition %s on '%s')", esp.device, esp.partition, esp.disk)
+        self._initialized = True
+
+        if cache is not None:
+            try:
+                with Trace.span ("store discovery cache", "discovery"):
+                    cache.store ({"ESPs": [list (esp) for esp in self.ESPs]})
+            except OSError as e:
+                Log.efibootmgr.debug ("Could not write discovery cache '%s': %s", cache.path, e)
+
+    def _get_discovery_cache (self):
+        from clover_config.cache import DiscoveryCache
+
+        if self.CachePath is None:
+            return None
+        return DiscoveryCache (
+            self.CachePath, self.MountInfoPath, scope = (self.EFIVarsRoot, self.SysFSRoot, self.UdevDataPath)
+        )
+
+    def _load_discovery (self, cache):
+        try:
+            values = cache.load ()
+        except OSError as e:
+            Log.efibootmgr.debug ("Could not validate discovery cache '%s': %s", cache.path, e)
+            return False
+
+        from clover_config.blockdev import ESP
+
+        esps = values.get ("ESPs") if isinstance (values, dict) else None
+        if (not isinstance (esps, list) or len (esps) == 0 or
+                any (not isinstance (esp, list) or len (esp) != len (ESP._fields) for esp in esps)):
+            return False
+
+        Log.efibootmgr.debug ("Using cached EFI partition discovery from '%s'", cache.path)
+        self._use_esps ([ESP (*esp) for esp in esps])
+        return True
+
+    def _use_esps (self, esps):
+        self.ESPs = tuple (esps)
+        primary = self.ESPs[0]
+        self.Device = primary.device
+        self.Disk = primary.disk
+        self.Partition = primary.partition
+        self.Mountpoint = primary.mountpoint
+        self.PartUUID = primary.partuuid
+        for esp in self.ESPs:
+            Log.efibootmgr.info ("Using %s as EFI partition mountpoint.", esp.mountpoint)
+
+    def get_esps (self):
+        self._initialize ()
+        return self.ESPs
 
-        if EFIBootManager.Device is None:
-            Log.die (ExitCode.NO_EFI_DEVICE, "No mounted EFI partition found")
+    def _scan_sysfs (self):
+        from clover_config.sysblock import SysBlock
 
-        EFIBootManager.Disk = LsBlk.get_disk_from_device (EFIBootManager.Device)
-        EFIBootManager.Partition = LsBlk.get_partition_from_device (EFIBootManager.Device)
-        EFIBootManager.Mountpoint = LsBlk.get_mountpoint_from_device (EFIBootManager.Device)
-        Log.efibootmgr.info ("Using %s as EFI partition mountpoint.", EFIBootManager.Mountpoint)
-        EFIBootManager._initialized = True
+        sysblock = SysBlock (self.SysFSRoot, self.MountInfoPath, self.UdevDataPath)
+        if not sysblock.available ():
+            Log.efibootmgr.debug ("No sysfs block devices or udev database found, falling back to lsblk")
+            return None
+
+        try:
+            with Trace.span ("sysfs scan", "discovery"):
+                return sysblock.get_device_tree ()
+        except OSError as e:
+            Log.efibootmgr.debug ("Scanning sysfs failed (%s), falling back to lsblk", e)
+            return None
+
+    def get_device_tree (self):
+        """
+        The block devices of the system, scanned once and kept along with
+        the EFI partitions found in them until `reset` is called.
+        """
+        if self._device_tree is not None:
+            return self._device_tree
+        tree = self._scan_sysfs ()
+        if tree is None:
+            from clover_config.lsblk import LsBlk
+            tree = LsBlk.get_device_tree ()
+        self._device_tree = tree
+        return tree
+
+    async def get_device_tree_async (self):
+        from clover_config.runner import run_in_thread
+
+        if self._device_tree is not None:
+            return self._device_tree
+        tree = await run_in_thread (self._scan_sysfs)
+        if tree is None:
+            from clover_config.lsblk import LsBlk
+            tree = await LsBlk.get_device_tree_async ()
+        self._device_tree = tree
+        return tree
+
+    def get_boot_state (self):
+        self._initialize (prefetch_boot_state = True)
+        return self.read_boot_state ()
+
+    def read_boot_state (self):
+        """
+        The boot entries, read without discovering the EFI partitions first,
+        so entries can be removed even if no EFI partition is mounted.
+        """
+        if self._boot_state is not None:
+            return self._boot_state
+        if not self._initialized:
+            self.check_efi ()
+        self._boot_state = self._read_efivars ()
+        if self._boot_state is None:
+            self._boot_state = self._parse_boot_state (self._efibootmgr ("-v"))
+        return self._boot_state
+
+    async def _read_boot_state_async (self):
+        from clover_config.runner import run_in_thread
+
+        state = await run_in_thread (self._read_efivars)
+        if state is None:
+            state = self._parse_boot_state (await self._efibootmgr_async ("-v"))
+        return state
 
     @staticmethod
-    def get_bootnum (entry):
-        EFIBootManager._initialize ()
-        regex = r"^Boot(\w{4}).?\s+" + re.escape (entry) + r"$"
-        m = re.search (regex, efibootmgr (), re.MULTILINE)
-        res = m.group (1) if m is not None else None
+    def _parse_boot_state (output):
+        from clover_config.bootstate import BootState
+
+        with Trace.span ("parse efibootmgr output", "parse"):
+            return BootState.parse (output)
+
+    def _read_efivars (self):
+        from clover_config.efivars import EFIVars
+
+        efivars = EFIVars (self.EFIVarsRoot)
+        if not efivars.available ():
+            Log.efibootmgr.debug ("No efivarfs found at '%s', falling back to efibootmgr", efivars.root)
+            return None
+
+        try:
+            with Trace.span ("efivarfs read", "discovery"):
+                return efivars.get_boot_state ()
+        except (OSError, ValueError) as e:
+            Log.efibootmgr.debug ("Reading efivarfs failed (%s), falling back to efibootmgr", e)
+            return None
+
+    def invalidate (self):
+        self._boot_state = None
+
+    def reset (self):
+        """
+        Forget the discovered EFI partition along with the boot state.
+        """
+        for field in DISCOVERY_FIELDS:
+            setattr (self, field, None)
+        self.ESPs = ()
+        self._initialized = False
+        self._boot_state = None
+        self._device_tree = None
+
+    def get_bootnum (self, entry):
+        res = self.get_boot_state ().get_bootnum (entry)
         Log.efibootmgr.debug ("Boot entry position of '%s' is %s", entry, res)
         return res
 
-    @staticmethod
-    def is_active (entry):
-        EFIBootManager._initialize ()
-        regex = r"^Boot\w{4}\*\s+" + re.escape (entry) + r"$"
-        m = re.search (regex, efibootmgr (), re.MULTILINE)
-        res = True if m is not None else None
+    def is_active (self, entry):
+        res = self.get_boot_state ().is_active (entry)
         Log.efibootmgr.debug ("Boot entry '%s' is %s", entry, "active" if res else "inactive")
         return res
 
-    @staticmethod
-    def try_remove_boot_entry (entry):
-        EFIBootManager._initialize ()
-        Log.efibootmgr.info ("Removing old '%s' boot entry of existing...", entry)
-        bootnum = EFIBootManager.get_bootnum (entry)
+    def remove_boot_entry (self, bootnum):
+        Log.efibootmgr.info ("Removing boot entry Boot%s...", bootnum)
+        self._efibootmgr ("-b", bootnum, "-B")
 
-        if bootnum is not None:
-            efibootmgr ("-b", bootnum, "-B")
+    def activate_boot_entry (self, bootnum):
+        self._initialize ()
+        Log.efibootmgr.info ("Activating boot entry Boot%s...", bootnum)
+        self._efibootmgr ("-b", bootnum, "-a")
 
-    @staticmethod
-    def get_boot_order ():
-        EFIBootManager._initialize ()
-        regex = r"BootOrder: (.+)"
-        m = re.search (regex, efibootmgr ())
-        res = m.group (1) if m is not None else ""
+    def get_boot_order (self):
+        res = ",".join (self.get_boot_state ().boot_order)
         Log.efibootmgr.debug ("Current EFI boot order is: %s", res)
         return res
 
-    @staticmethod
-    def set_boot_order (boot_order):
-        EFIBootManager._initialize ()
+    def set_boot_order (self, boot_order):
+        self._initialize ()
         Log.efibootmgr.info ("Writing new boot order...")
         Log.efibootmgr.debug ("New EFI boot order is: %s", boot_order)
-        efibootmgr ("-o", boot_order)
+        self._efibootmgr ("-o", boot_order)
 
-    @staticmethod
-    def add_boot_entry (label, loader):
-        EFIBootManager._initialize ()
+    def add_boot_entry (self, label, loader, disk = None, partition = None):
+        """
+        Create a boot entry for `loader` on the given partition, the primary
+        EFI partition by default.
+        """
+        self._initialize ()
         Log.efibootmgr.info ("Adding new '%s' boot entry...", label)
-        efibootmgr ("-d", EFIBootManager.Disk, "-p", EFIBootManager.Partition, "-c", "-L", label, "-l", loader)
+        self._efibootmgr ("-d", disk or self.Disk, "-p", partition or self.Partition, "-c", "-L", label, "-l", loader)
 
-    @staticmethod
-    def check_efi ():
+    def entry_matches (self, entry, desired):
+        from clover_config.plan import entry_matches
+
+        return entry_matches (entry, desired)
+
+    def apply (self, operations):
+        from clover_config.plan import REMOVE, CREATE, ACTIVATE, ORDER
+
+        for operation in operations:
+            if operation.kind == REMOVE:
+                self.remove_boot_entry (operation.bootnum)
+            elif operation.kind == CREATE:
+                entry = operation.entry
+                self.add_boot_entry (entry.label, entry.loader, entry.disk, entry.partition)
+            elif operation.kind == ACTIVATE:
+                self.activate_boot_entry (operation.bootnum)
+            elif operation.kind == ORDER:
+                self.set_boot_order (",".join (operation.boot_order))
+
+    def check_efi (self):
         Log.efibootmgr.info ("Checking if system is booted in EFI mode...")
-        Log.efibootmgr.debug ("Checking if '/sys/firmware/efi' exists...")
+        Log.efibootmgr.debug ("Checking if '%s' exists...", self.FirmwarePath)
 
-        if not os.path.isdir ("/sys/firmware/efi"):
+        if not os.path.isdir (self.FirmwarePath):
             Log.efibootmgr.error ("This system is not booted in EFI mode!")
             Log.efibootmgr.error ("")
             Log.efibootmgr.error ("Note: This program currently has no support for BIOS booted systems.")
@@ -136,4 +365,7 @@ class EFIBootManager:
             Log.efibootmgr.error ("      a pull request on github adding BIOS support to this program.")
             Log.efibootmgr.error ("")
             Log.efibootmgr.error ("GitHub: https://github.com/fin-ger/clover-config")
-            Log.die (ExitCode.NOT_IN_EFI_MODE, "System is NOT booted in EFI mode!")
+            raise NotInEFIModeError ("System is NOT booted in EFI mode!")
+
+# the boot manager of the running system used by the command line tool
+EFIBootManager = BootManager ()
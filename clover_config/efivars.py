@@ -0,0 +1,180 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import os.path
+import re
+import struct
+
+from clover_config.bootstate import BootEntry, BootState
+from clover_config.paths import EFIVARS_PATH
+
+EFI_GLOBAL_VARIABLE = "8be4df61-93ca-11d2-aa0d-00e098032b8c"
+
+LOAD_OPTION_ACTIVE = 0x00000001
+
+DEVICE_PATH_MEDIA = 0x04
+DEVICE_PATH_END = 0x7f
+
+MEDIA_HARDDRIVE = 0x01
+MEDIA_FILEPATH = 0x04
+
+END_ENTIRE = 0xff
+END_INSTANCE = 0x01
+
+SIGNATURE_MBR = 0x01
+SIGNATURE_GUID = 0x02
+
+BOOT_VARIABLE_REGEX = re.compile (r"^Boot([0-9A-Fa-f]{4})-" + re.escape (EFI_GLOBAL_VARIABLE) + r"$")
+
+def format_guid (data, offset = 0):
+    a, b, c = struct.unpack_from ("<IHH", data, offset)
+    rest = data[offset + 8:offset + 16].hex ()
+    return "{:08x}-{:04x}-{:04x}-{}-{}".format (a, b, c, rest[:4], rest[4:])
+
+def read_utf16 (data, offset, end):
+    """
+    Decode a NUL terminated UCS-2 string starting at `offset` and return it
+    together with the offset right behind the terminator.
+    """
+    pos = offset
+    while pos + 1 < end:
+        if data[pos] == 0 and data[pos + 1] == 0:
+            return str (data[offset:pos], "utf-16-le"), pos + 2
+        pos += 2
+    raise ValueError ("Unterminated UCS-2 string at offset {}".format (offset))
+
+def _format_harddrive (node):
+    number, start, size = struct.unpack_from ("<IQQ", node, 4)
+    signature_type = node[41]
+    if signature_type == SIGNATURE_GUID:
+        signature = "GPT,{}".format (format_guid (node, 24))
+    elif signature_type == SIGNATURE_MBR:
+        signature = "MBR,0x{:08x}".format (struct.unpack_from ("<I", node, 24)[0])
+    else:
+        signature = "{},{}".format (signature_type, node[24:40].hex ())
+    return "HD({},{},0x{:x},0x{:x})".format (number, signature, start, size)
+
+def _format_filepath (node):
+    return "File({})".format (str (node[4:], "utf-16-le").rstrip ("\0"))
+
+def format_device_path (data):
+    """
+    Render a binary EFI device path in the textual notation used by
+    `efibootmgr -v`. Nodes we do not care about are rendered generically.
+    """
+    parts = []
+    offset = 0
+    while offset + 4 <= len (data):
+        node_type, node_subtype, length = struct.unpack_from ("<BBH", data, offset)
+        if length < 4 or offset + length > len (data):
+            raise ValueError ("Malformed device path node at offset {}".format (offset))
+        node = data[offset:offset + length]
+        offset += length
+
+        if node_type == DEVICE_PATH_END:
+            if node_subtype == END_ENTIRE:
+                break
+            parts.append (",")
+            continue
+
+        if node_type == DEVICE_PATH_MEDIA and node_subtype == MEDIA_HARDDRIVE and length >= 42:
+            text = _format_harddrive (node)
+        elif node_type == DEVICE_PATH_MEDIA and node_subtype == MEDIA_FILEPATH:
+            text = _format_filepath (node)
+        else:
+            text = "Path({},{},{})".format (node_type, node_subtype, node[4:].hex ())
+
+        if parts and parts[-1] != ",":
+            parts.append ("/")
+        parts.append (text)
+
+    return "".join (parts)
+
+def parse_load_option (data):
+    """
+    Decode an EFI_LOAD_OPTION into its attributes, description and the
+    textual representation of its device path.
+    """
+    attributes, path_length = struct.unpack_from ("<IH", data, 0)
+    description, offset = read_utf16 (data, 6, len (data))
+    if offset + path_length > len (data):
+        raise ValueError ("Device path exceeds load option size")
+    device_path = format_device_path (data[offset:offset + path_length])
+    return attributes, description, device_path
+
+class EFIVars:
+    def __init__ (self, root = EFIVARS_PATH):
+        self.root = root
+
+    def available (self):
+        return os.path.isdir (self.root)
+
+    def read (self, name, guid = EFI_GLOBAL_VARIABLE):
+        """
+        Return the payload of an EFI variable without its leading attribute
+        word as a `memoryview` or `None` if the variable does not exist.
+        """
+        try:
+            with open (os.path.join (self.root, "{}-{}".format (name, guid)), "rb", buffering = 0) as f:
+                raw = f.readall ()
+        except FileNotFoundError:
+            return None
+        if len (raw) < 4:
+            raise ValueError ("EFI variable {} is truncated".format (name))
+        return memoryview (raw)[4:]
+
+    def _read_u16 (self, name):
+        data = self.read (name)
+        if data is None or len (data) < 2:
+            return None
+        return struct.unpack_from ("<H", data)[0]
+
+    def get_boot_order (self):
+        data = self.read ("BootOrder")
+        if data is None:
+            return ()
+        count = len (data) // 2
+        return tuple ("{:04X}".format (num) for num in struct.unpack_from ("<{}H".format (count), data))
+
+    def get_boot_current (self):
+        current = self._read_u16 ("BootCurrent")
+        return "{:04X}".format (current) if current is not None else None
+
+    def get_timeout (self):
+        return self._read_u16 ("Timeout")
+
+    def get_boot_entries (self):
+        entries = []
+        for name in sorted (os.listdir (self.root)):
+            m = BOOT_VARIABLE_REGEX.match (name)
+            if m is None:
+                continue
+            data = self.read ("Boot" + m.group (1))
+            if data is None:
+                continue
+            attributes, description, device_path = parse_load_option (data)
+            entries.append (BootEntry (
+                m.group (1).upper (), description, bool (attributes & LOAD_OPTION_ACTIVE), device_path
+            ))
+        return entries
+
+    def get_boot_state (self):
+        return BootState.from_entries (
+            self.get_boot_entries (), self.get_boot_order (), self.get_timeout (), self.get_boot_current ()
+        )
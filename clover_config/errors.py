@@ -0,0 +1,63 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from clover_config.exit_code import ExitCode
+
+class CloverConfigError (Exception):
+    """
+    Base class of all errors clover-config reports. Every subclass carries
+    the `ExitCode` the command line tool terminates with.
+    """
+    exit_code = None
+
+class EFIBootManagerError (CloverConfigError):
+    exit_code = ExitCode.EFIBOOTMGR_ERROR
+
+class NoEFIDeviceError (CloverConfigError):
+    exit_code = ExitCode.NO_EFI_DEVICE
+
+class NotInEFIModeError (CloverConfigError):
+    exit_code = ExitCode.NOT_IN_EFI_MODE
+
+class ExecutableNotFoundError (CloverConfigError):
+    exit_code = ExitCode.NOT_ROOT
+
+    def __init__ (self, executable):
+        super ().__init__ (
+            "Executable '{}' not found in PATH! Try running this program as root or install the package "
+            "containing this executable with your distributions package manager".format (executable)
+        )
+        self.executable = executable
+
+class ConfigError (CloverConfigError):
+    exit_code = ExitCode.CONFIG_ERROR
+
+class DaemonError (CloverConfigError):
+    exit_code = ExitCode.SOCKET_ERROR
+
+class PayloadError (CloverConfigError):
+    exit_code = ExitCode.PAYLOAD_ERROR
+
+class WatchError (CloverConfigError):
+    exit_code = ExitCode.WATCH_ERROR
+
+class LockError (CloverConfigError):
+    exit_code = ExitCode.LOCK_ERROR
+
+class UpdateError (CloverConfigError):
+    exit_code = ExitCode.UPDATE_ERROR
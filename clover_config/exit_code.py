@@ -24,3 +24,9 @@ class ExitCode (Enum):
     NO_EFI_DEVICE = 2
     NOT_IN_EFI_MODE = 3
     NOT_ROOT = 4
+    CONFIG_ERROR = 5
+    SOCKET_ERROR = 6
+    PAYLOAD_ERROR = 7
+    WATCH_ERROR = 8
+    LOCK_ERROR = 9
+    UPDATE_ERROR = 10
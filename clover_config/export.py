@@ -0,0 +1,72 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+
+from collections import OrderedDict
+
+# Output formats of `status`. Prometheus metrics follow the node_exporter
+# textfile collector format and carry no timestamps, so the output only
+# changes when the state does.
+
+METRIC_PREFIX = "clover_config_"
+
+def to_dict (report):
+    status = OrderedDict (report.status._asdict ())
+    status["boot_order"] = list (report.status.boot_order)
+    status["esps"] = [OrderedDict (esp._asdict ()) for esp in report.esps]
+    return status
+
+def format_json (report):
+    return json.dumps (to_dict (report), indent = 2) + "\n"
+
+def _escape (value):
+    return value.replace ("\\", "\\\\").replace ("\n", "\\n").replace ("\"", "\\\"")
+
+def _labels (**labels):
+    pairs = ('{}="{}"'.format (name, _escape (value or "")) for name, value in sorted (labels.items ()))
+    return "{" + ",".join (pairs) + "}"
+
+def _metric (lines, name, description, samples):
+    lines.append ("# HELP {}{} {}".format (METRIC_PREFIX, name, description))
+    lines.append ("# TYPE {}{} gauge".format (METRIC_PREFIX, name))
+    for labels, value in samples:
+        lines.append ("{}{}{} {}".format (METRIC_PREFIX, name, labels, int (value)))
+
+def format_prometheus (report):
+    status = report.status
+    esps = [(_labels (device = esp.device, mountpoint = esp.mountpoint, label = esp.label), esp)
+            for esp in report.esps]
+    lines = []
+    _metric (lines, "installed", "Whether the Clover boot entry exists.", [("", status.installed)])
+    _metric (lines, "active", "Whether the Clover boot entry is active.", [("", status.active)])
+    _metric (lines, "boot_position", "Position of the Clover boot entry in BootOrder, -1 if it is not listed.",
+             [("", status.position if status.position is not None else -1)])
+    _metric (lines, "esp_installed", "Whether the boot entry of the EFI partition exists.",
+             [(labels, esp.installed) for labels, esp in esps])
+    _metric (lines, "esp_active", "Whether the boot entry of the EFI partition is active.",
+             [(labels, esp.active) for labels, esp in esps])
+    _metric (lines, "payload_info", "Version of the Clover payload on the EFI partition.",
+             [(_labels (device = esp.device, mountpoint = esp.mountpoint, version = esp.payload_version), 1)
+              for esp in report.esps if esp.payload_version is not None])
+    return "\n".join (lines) + "\n"
+
+FORMATS = OrderedDict ([
+    ("json", format_json),
+    ("prometheus", format_prometheus),
+])
@@ -0,0 +1,96 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import os.path
+
+def fsync_directory (path):
+    fd = os.open (path, os.O_RDONLY)
+    try:
+        os.fsync (fd)
+    finally:
+        os.close (fd)
+
+def create_temporary (directory):
+    """
+    Create a hidden temporary file in `directory` and return its file
+    descriptor and path. Renaming it stays within the same filesystem.
+    """
+    import tempfile
+
+    return tempfile.mkstemp (prefix = ".", suffix = ".tmp", dir = directory)
+
+def sync_filesystem (path):
+    """
+    Flush all pending writes of the filesystem containing `path` at once
+    with syncfs(2), falling back to sync(2) where it is not available.
+    """
+    import ctypes
+
+    from clover_config.libc import get_libc
+
+    try:
+        syncfs = get_libc ().syncfs
+    except (OSError, AttributeError):
+        os.sync ()
+        return
+
+    fd = os.open (path, os.O_RDONLY)
+    try:
+        if syncfs (fd) != 0:
+            errno = ctypes.get_errno ()
+            raise OSError (errno, os.strerror (errno), path)
+    finally:
+        os.close (fd)
+
+def atomic_write (path, data, mode = 0o644):
+    """
+    Replace the file at `path` with `data` so readers either see the old or
+    the new content: write to a temporary file in the same directory, fsync
+    it and rename it over the destination.
+    """
+    directory = os.path.dirname (os.path.abspath (path))
+    fd, tmp_path = create_temporary (directory)
+    try:
+        with os.fdopen (fd, "wb") as f:
+            f.write (data)
+            f.flush ()
+            os.fsync (f.fileno ())
+        os.chmod (tmp_path, mode)
+        os.replace (tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink (tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    fsync_directory (directory)
+
+def write_if_changed (path, data, mode = 0o644):
+    """
+    Atomically replace the file at `path` with `data` unless it already
+    has this content. Returns whether the file was written.
+    """
+    try:
+        with open (path, "rb") as f:
+            if f.read () == data:
+                return False
+    except FileNotFoundError:
+        pass
+    atomic_write (path, data, mode)
+    return True
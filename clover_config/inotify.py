@@ -0,0 +1,104 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import ctypes
+import os
+import struct
+
+from collections import namedtuple
+
+from clover_config.libc import get_libc
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# any change to the content or the entries of a directory
+IN_CHANGED = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+EVENT_HEADER = struct.Struct ("iIII")
+
+class Event (namedtuple ("Event", ["wd", "mask", "cookie", "name"])):
+    __slots__ = ()
+
+def parse_events (data):
+    events = []
+    offset = 0
+    while offset + EVENT_HEADER.size <= len (data):
+        wd, mask, cookie, length = EVENT_HEADER.unpack_from (data, offset)
+        offset += EVENT_HEADER.size
+        name = data[offset:offset + length].rstrip (b"\0").decode (errors = "surrogateescape")
+        offset += length
+        events.append (Event (wd, mask, cookie, name))
+    return events
+
+class Inotify:
+    """
+    A non-blocking inotify instance. Raises `OSError` if inotify is not
+    available on this system.
+    """
+
+    def __init__ (self):
+        try:
+            libc = get_libc ()
+            self.fd = libc.inotify_init1 (os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            raise OSError ("inotify is not available: {}".format (e))
+        if self.fd < 0:
+            errno = ctypes.get_errno ()
+            raise OSError (errno, os.strerror (errno))
+        self.watches = {}
+
+    def fileno (self):
+        return self.fd
+
+    def add_watch (self, path, mask = IN_CHANGED):
+        wd = get_libc ().inotify_add_watch (self.fd, os.fsencode (path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno ()
+            raise OSError (errno, os.strerror (errno), path)
+        self.watches[wd] = path
+        return wd
+
+    def read (self):
+        """
+        Return all pending events or an empty list if there are none.
+        """
+        try:
+            data = os.read (self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = parse_events (data)
+        for event in events:
+            if event.mask & IN_IGNORED:
+                self.watches.pop (event.wd, None)
+        return events
+
+    def close (self):
+        if self.fd >= 0:
+            os.close (self.fd)
+            self.fd = -1
@@ -0,0 +1,212 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+import os.path
+import re
+import struct
+
+from collections import namedtuple
+
+from clover_config.log import Log
+
+CACHE_VERSION = 1
+KERNEL_PREFIXES = ("vmlinuz-", "vmlinux-", "bzImage-", "kernel-")
+# initramfs names used by the distributions for a kernel suffix, in order of preference
+INITRD_PATTERNS = ("initramfs-{}.img", "initrd.img-{}", "initrd-{}.img", "initrd-{}", "initramfs-{}")
+# microcode updates have to be loaded before the initramfs
+MICROCODE_IMAGES = ("intel-ucode.img", "amd-ucode.img")
+KERNEL_CMDLINE_PATHS = ("/etc/kernel/cmdline", "/proc/cmdline")
+# kernel command line parameters added by the previous boot loader
+BOOTLOADER_PARAMETERS = ("BOOT_IMAGE=", "initrd=")
+VERSION_PART_REGEX = re.compile (r"\d+|[^\d.+~_-]+")
+
+# offsets into the x86 boot protocol header of a bzImage
+SETUP_HEADER_MAGIC_OFFSET = 0x202
+SETUP_HEADER_MAGIC = b"HdrS"
+KERNEL_VERSION_OFFSET = 0x20e
+
+class Kernel (namedtuple ("Kernel", ["path", "version", "initrds"])):
+    """
+    A kernel image found by the scanner. `initrds` are the paths of the
+    images to load along with it, microcode first.
+    """
+    __slots__ = ()
+
+def version_key (version):
+    """
+    Sort key comparing the numeric parts of a version numerically, so
+    5.10 sorts after 5.9.
+    """
+    return tuple ((1, int (part), "") if part.isdigit () else (0, 0, part)
+                  for part in VERSION_PART_REGEX.findall (version))
+
+def read_image_version (path):
+    """
+    Read the version string embedded in an x86 bzImage or return None.
+    """
+    try:
+        with open (path, "rb") as f:
+            f.seek (SETUP_HEADER_MAGIC_OFFSET)
+            if f.read (4) != SETUP_HEADER_MAGIC:
+                return None
+            f.seek (KERNEL_VERSION_OFFSET)
+            offset = struct.unpack ("<H", f.read (2))[0]
+            if offset == 0:
+                return None
+            f.seek (offset + 0x200)
+            version = f.read (256).split (b"\0", 1)[0].split (b" ", 1)[0]
+    except (OSError, struct.error):
+        return None
+    return version.decode (errors = "replace") or None
+
+def _find_kernels (directory, names):
+    microcode = [os.path.join (directory, name) for name in MICROCODE_IMAGES if name in names]
+    kernels = []
+    for name in names:
+        prefix = next ((prefix for prefix in KERNEL_PREFIXES if name.startswith (prefix)), None)
+        if prefix is None:
+            continue
+        suffix = name[len (prefix):]
+        path = os.path.join (directory, name)
+        # names like vmlinuz-linux carry the package name instead of the version
+        version = suffix if suffix[:1].isdigit () else read_image_version (path) or suffix
+        initrd = next ((pattern.format (suffix) for pattern in INITRD_PATTERNS if pattern.format (suffix) in names),
+                       None)
+        initrds = microcode + ([os.path.join (directory, initrd)] if initrd is not None else [])
+        kernels.append (Kernel (path, version, tuple (initrds)))
+    return kernels
+
+def _mount_root (path, root = "/"):
+    path = os.path.realpath (path)
+    while path != root and not os.path.ismount (path):
+        path = os.path.dirname (path)
+    return path
+
+def _efi_path (path, root):
+    return "\\" + os.path.relpath (path, root).replace ("/", "\\")
+
+def get_menu_entries (kernels, options = "", tree = None, root = "/"):
+    """
+    Turn kernels into menu entries booting them from the filesystem they
+    live on. The volume is only set if the partition can be found in the
+    `DeviceTree`. Paths never reach above `root`, the root of the system
+    the kernels belong to.
+    """
+    from clover_config.menu import MenuEntry
+
+    entries = []
+    for kernel in kernels:
+        volume = _mount_root (os.path.dirname (kernel.path), os.path.realpath (root))
+        values = {"type": "Linux", "path": _efi_path (kernel.path, volume)}
+        partition = tree.get_by_mountpoint (volume) if tree is not None else None
+        if partition is not None and partition.partuuid is not None:
+            values["volume"] = partition.partuuid
+
+        arguments = [options] if options else []
+        arguments.extend ("initrd=" + _efi_path (initrd, volume) for initrd in kernel.initrds)
+        if arguments:
+            values["options"] = " ".join (arguments)
+        entries.append (MenuEntry ("Linux {}".format (kernel.version), tuple (sorted (values.items ()))))
+    return entries
+
+def get_kernel_options (configured = "", root = "/"):
+    """
+    The kernel command line for generated entries: the configured one or
+    the one of the system at `root`. Only the running system falls back to
+    the command line it was booted with.
+    """
+    if configured:
+        return configured
+    paths = KERNEL_CMDLINE_PATHS if root == "/" else [os.path.join (root, KERNEL_CMDLINE_PATHS[0].lstrip ("/"))]
+    for path in paths:
+        try:
+            with open (path) as f:
+                parameters = f.read ().split ()
+        except OSError:
+            continue
+        return " ".join (parameter for parameter in parameters
+                         if not parameter.startswith (BOOTLOADER_PARAMETERS))
+    return ""
+
+class KernelScanner:
+    """
+    Find the kernels and their initramfs images in a list of directories,
+    newest first.
+
+    The sorted result is cached keyed on the modification times of the
+    directories, which change whenever a kernel is added, removed or
+    renamed, so most runs only stat the directories.
+    """
+
+    def __init__ (self, directories, cache = None):
+        self.directories = directories
+        self.cache = cache
+
+    def key (self):
+        key = [CACHE_VERSION]
+        for directory in self.directories:
+            try:
+                key.append ([directory, os.stat (directory).st_mtime_ns])
+            except OSError:
+                key.append ([directory, None])
+        return key
+
+    def _load_cache (self, key):
+        try:
+            with open (self.cache) as f:
+                content = json.load (f)
+            if content["key"] != key:
+                return None
+            return [Kernel (path, version, tuple (initrds)) for path, version, initrds in content["kernels"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _store_cache (self, key, kernels):
+        from clover_config.fsutil import atomic_write
+
+        directory = os.path.dirname (self.cache)
+        if not os.path.isdir (directory):
+            os.makedirs (directory)
+        atomic_write (self.cache, json.dumps ({"key": key, "kernels": kernels}).encode ())
+
+    def scan (self):
+        key = self.key ()
+        if self.cache is not None:
+            kernels = self._load_cache (key)
+            if kernels is not None:
+                return kernels
+
+        kernels = []
+        for directory in self.directories:
+            try:
+                names = {entry.name for entry in os.scandir (directory) if entry.is_file ()}
+            except OSError as e:
+                Log.kernels.debug ("Cannot scan '%s' for kernels: %s", directory, e)
+                continue
+            kernels.extend (_find_kernels (directory, names))
+        kernels.sort (key = lambda kernel: (version_key (kernel.version), kernel.path), reverse = True)
+        Log.kernels.debug ("Found %d kernels in %s", len (kernels), ", ".join (self.directories))
+
+        if self.cache is not None:
+            try:
+                self._store_cache (key, kernels)
+            except OSError as e:
+                Log.kernels.debug ("Could not write kernel cache '%s': %s", self.cache, e)
+        return kernels
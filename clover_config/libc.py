@@ -0,0 +1,32 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import ctypes
+import ctypes.util
+
+_libc = None
+
+def get_libc ():
+    """
+    Return the C library for system calls the os module does not wrap.
+    Raises `OSError` if it cannot be loaded.
+    """
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL (ctypes.util.find_library ("c") or "libc.so.6", use_errno = True)
+    return _libc
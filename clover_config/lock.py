@@ -0,0 +1,116 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import fcntl
+import os
+import os.path
+import time
+
+from contextlib import contextmanager
+
+from clover_config.errors import LockError
+from clover_config.log import Log
+from clover_config.trace import Trace
+
+LOCK_TIMEOUT = 30.0
+# polling interval while waiting for a lock, doubled up to the maximum
+POLL_INTERVAL = 0.005
+MAX_POLL_INTERVAL = 0.1
+
+class LockManager:
+    """
+    Reader/writer locking between clover-config processes with `flock` on
+    a lock file.
+
+    Read-only operations take the lock shared and run concurrently, while
+    sequences changing the boot entries or the EFI partitions take it
+    exclusively. Waiting for a lock gives up after `timeout` seconds with
+    a `LockError`. Locks are not reentrant.
+    """
+
+    def __init__ (self, path, timeout = LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+
+    def _open (self):
+        directory = os.path.dirname (self.path)
+        if not os.path.isdir (directory):
+            os.makedirs (directory)
+        try:
+            return os.open (self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        except PermissionError:
+            # a lock file created by root can still be locked shared by everyone
+            return os.open (self.path, os.O_RDONLY | os.O_CLOEXEC)
+
+    def _acquire (self, fd, operation, kind):
+        try:
+            fcntl.flock (fd, operation | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            pass
+
+        Log.lock.info ("Waiting for another clover-config process to release the %s lock...", kind)
+        deadline = time.monotonic () + self.timeout
+        interval = POLL_INTERVAL
+        while True:
+            remaining = deadline - time.monotonic ()
+            if remaining <= 0:
+                raise LockError ("Timed out after {:g} seconds waiting for the {} lock on '{}'".format (
+                    self.timeout, kind, self.path
+                ))
+            time.sleep (min (interval, remaining))
+            interval = min (interval * 2, MAX_POLL_INTERVAL)
+            try:
+                fcntl.flock (fd, operation | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                pass
+
+    @contextmanager
+    def _locked (self, operation, kind):
+        try:
+            fd = self._open ()
+        except OSError as e:
+            raise LockError ("Cannot open the lock file '{}': {}".format (self.path, e.strerror))
+        try:
+            with Trace.span ("acquire {} lock".format (kind), "lock"):
+                self._acquire (fd, operation, kind)
+            yield
+        finally:
+            # closing the file releases the lock
+            os.close (fd)
+
+    def shared (self):
+        return self._locked (fcntl.LOCK_SH, "shared")
+
+    def exclusive (self):
+        return self._locked (fcntl.LOCK_EX, "exclusive")
+
+class NoLock:
+    """
+    A `LockManager` that does not lock at all, for callers doing their own
+    synchronization.
+    """
+
+    @contextmanager
+    def shared (self):
+        yield
+
+    @contextmanager
+    def exclusive (self):
+        yield
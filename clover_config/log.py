@@ -17,59 +17,167 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import sys
+import atexit
 import logging
-import logging.handlers
 import os.path
-
-from colorlog import ColoredFormatter
-
-HAS_SYSTEMD = True
-try:
+import queue
+import threading
+
+# colorlog, the systemd journal bindings and logging.handlers are imported by
+# the handlers using them, so merely importing this module stays cheap.
+
+# maximum number of records a sink handles before it gets flushed
+BATCH_SIZE = 256
+
+class LazyHandler (logging.Handler):
+    """
+    A handler that creates the handler it forwards to on its first record.
+    Sinks that are never written to are never set up.
+    """
+
+    def __init__ (self, factory, level = logging.NOTSET):
+        super ().__init__ (level)
+        self._factory = factory
+        self.handler = None
+
+    def emit (self, record):
+        if self.handler is None:
+            self.handler = self._factory ()
+        self.handler.handle (record)
+
+    def flush (self):
+        if self.handler is not None:
+            self.handler.flush ()
+
+    def close (self):
+        if self.handler is not None:
+            self.handler.close ()
+        super ().close ()
+
+class BatchingQueueListener:
+    """
+    Counterpart of `logging.handlers.QueueHandler` that handles queued
+    records on a background thread. It drains all records available at once
+    and flushes the sink once per batch instead of once per record.
+    """
+
+    _sentinel = None
+
+    def __init__ (self, record_queue, handler):
+        self.queue = record_queue
+        self.handler = handler
+        self._thread = None
+
+    def start (self):
+        self._thread = threading.Thread (target = self._monitor, name = "clover-config-log", daemon = True)
+        self._thread.start ()
+
+    def _monitor (self):
+        running = True
+        while running:
+            batch = [self.queue.get ()]
+            while len (batch) < BATCH_SIZE:
+                try:
+                    batch.append (self.queue.get_nowait ())
+                except queue.Empty:
+                    break
+
+            for record in batch:
+                if record is self._sentinel:
+                    running = False
+                    continue
+                try:
+                    self.handler.handle (record)
+                except Exception:
+                    self.handler.handleError (record)
+            self.handler.flush ()
+
+    def stop (self):
+        if self._thread is None:
+            return
+        self.queue.put (self._sentinel)
+        self._thread.join ()
+        self._thread = None
+
+def _journal_handler ():
     from systemd.journal import JournalHandler
-except ImportError as e:
-    HAS_SYSTEMD = False
+
+    handler = JournalHandler (SYSLOG_IDENTIFIER = "clover-config")
+    handler.setFormatter (logging.Formatter ("[{name:>15.15}] [{levelname:<8.8}]: {message}", style = "{"))
+    return handler
+
+def _file_handler ():
+    from logging.handlers import RotatingFileHandler
+
+    class BatchedRotatingFileHandler (RotatingFileHandler):
+        # StreamHandler flushes after every record, the listener flushes per batch instead
+        _emitting = False
+
+        def emit (self, record):
+            self._emitting = True
+            try:
+                super ().emit (record)
+            finally:
+                self._emitting = False
+
+        def flush (self):
+            if not self._emitting:
+                super ().flush ()
+
+    log_path = os.path.join (os.path.expanduser ("~"), ".local", "share", "clover-config")
+    if not os.path.exists (log_path):
+        os.makedirs (log_path)
+    handler = BatchedRotatingFileHandler (
+        os.path.join (log_path, "clover-config.log"),
+        # 1MB size and 10 files
+        maxBytes = 1048576, backupCount = 9
+    )
+    handler.setFormatter (logging.Formatter ("{asctime} [{name:<15.15}] [{levelname:<8.8}]: {message}", style = "{"))
+    return handler
+
+def _sink_handler ():
+    try:
+        return _journal_handler ()
+    except ImportError:
+        return _file_handler ()
+
+def _console_formatter (stream):
+    if not stream.isatty ():
+        return logging.Formatter (" * {message}", style = "{")
+
+    from colorlog import ColoredFormatter
+
+    return ColoredFormatter (
+        "{log_color} * {reset}{message}", style = "{",
+        log_colors={
+            'DEBUG':    'bold_cyan',
+            'INFO':     'bold_blue',
+            'WARNING':  'bold_yellow',
+            'ERROR':    'bold_red'
+        }
+    )
 
 class LogManager:
     def __init__ (self):
         self.root = None
-        self._file_formatter = None
-        self._syslog_formatter = None
-        self._console_formatter = None
         self._log_handler = None
         self._console_handler = None
+        self._listener = None
 
     def init (self, log_level):
-        self._file_formatter = logging.Formatter ("{asctime} [{name:<15.15}] [{levelname:<8.8}]: {message}", style = "{")
-        self._syslog_formatter = logging.Formatter ("[{name:>15.15}] [{levelname:<8.8}]: {message}", style = "{")
-        self._console_formatter = ColoredFormatter (
-            "{log_color} * {reset}{message}", style = "{",
-            log_colors={
-                'DEBUG':    'bold_cyan',
-                'INFO':     'bold_blue',
-                'WARNING':  'bold_yellow',
-                'ERROR':    'bold_red'
-            }
-        )
-
-        if HAS_SYSTEMD:
-            self._log_handler = JournalHandler (SYSLOG_IDENTIFIER = "clover-config")
-            self._log_handler.setFormatter (self._syslog_formatter)
-        else:
-            log_path = os.path.join (os.path.expanduser ("~"), ".local", "share", "clover-config")
-            if not os.path.exists (log_path):
-                os.makedirs (log_path)
-            log_file = os.path.join (log_path, "clover-config.log")
-            self._log_handler = logging.handlers.RotatingFileHandler (
-                log_file,
-                # 1MB size and 10 files
-                maxBytes = 1048576, backupCount = 9
-            )
-            self._log_handler.setFormatter (self._file_formatter)
+        from logging.handlers import QueueHandler
+
+        record_queue = queue.Queue ()
+        self._listener = BatchingQueueListener (record_queue, LazyHandler (_sink_handler))
+        self._listener.start ()
+        atexit.register (self.shutdown)
 
+        # the journal or log file only receives `info` and above
+        self._log_handler = QueueHandler (record_queue)
         self._log_handler.setLevel (logging.INFO)
 
         self._console_handler = logging.StreamHandler ()
-        self._console_handler.setFormatter (self._console_formatter)
+        self._console_handler.setFormatter (_console_formatter (self._console_handler.stream))
         self.set_log_level (log_level)
 
         self.root = logging.getLogger ()
@@ -78,17 +186,23 @@ class LogManager:
         self.root.addHandler (self._log_handler)
         self.root.addHandler (self._console_handler)
 
-        if HAS_SYSTEMD:
-            self.root.debug ("Using journald logging system...")
-        else:
-            self.root.debug ("Logging to `{}`".format (log_file))
+    def shutdown (self):
+        """
+        Stop the background listener after it wrote all queued records.
+        """
+        if self._listener is not None:
+            self._listener.stop ()
+            self._listener.handler.close ()
+            self._listener = None
+            self.root.removeHandler (self._log_handler)
 
     def __getattr__ (self, name):
         return logging.getLogger (name)
 
     def die (self, code, message = "An error occured during the execution of the current action"):
         self.root.error ("%s - aborting...", message)
-        self.root.debug ("Exiting with exit code %d", code)
+        self.root.debug ("Exiting with exit code %d", code.value)
+        self.shutdown ()
         sys.exit (code.value)
 
     def set_log_level (self, log_level):
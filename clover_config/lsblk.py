@@ -16,58 +16,73 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import subprocess
 import re
+import os.path
 
 from clover_config.log import Log
-from clover_config.exit_code import ExitCode
+from clover_config.errors import ExecutableNotFoundError
+from clover_config.blockdev import Mount, Partition, Disk, DeviceTree
+from clover_config.runner import run, run_command
+from clover_config.trace import Trace
 
-def lsblk (*parameters):
+async def lsblk_async (*parameters):
     Log.lsblk.debug ("Calling subprocess: lsblk %s", " ".join (parameters))
     try:
-        process = subprocess.Popen (["lsblk"] + list (parameters), stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        result = await run_command ("lsblk", *parameters)
     except FileNotFoundError:
-        Log.die (ExitCode.NOT_ROOT, "Executable 'lsblk' not found in PATH! Try running this program "
-                 "as root or install the package containing this executable with your distributions package manager")
-    out, err = process.communicate ()
+        raise ExecutableNotFoundError ("lsblk")
 
-    Log.lsblk.debug ("Subprocess lsblk exited with exit code %d", process.returncode)
+    Log.lsblk.debug ("Subprocess lsblk exited with exit code %d", result.returncode)
 
-    if len (err) > 0:
-        Log.lsblk.error (err.decode ())
+    if len (result.err) > 0:
+        Log.lsblk.error (result.err.decode ())
 
-    return out.decode ()
+    return result.out.decode ()
 
-class LsBlk:
-    @staticmethod
-    def get_efi_device ():
-        out = lsblk ("-lpno", "MOUNTPOINT,FSTYPE,PARTTYPE,NAME")
-        regex = r"^\/.+\s+vfat\s+c12a7328-f81f-11d2-ba4b-00a0c93ec93b\s+(.+)"
-        m = re.search (regex, out, re.MULTILINE)
-        res = m.group (1) if m is not None else None
-        Log.lsblk.debug ("EFI device is '%s'", res)
-        return res
+def lsblk (*parameters):
+    return run (lsblk_async (*parameters))
 
-    @staticmethod
-    def get_disk_from_device (device):
-        out = lsblk ("-lpno", "TYPE,NAME")
-        regex = r"disk\s+(.+?)\npart\s+" + re.escape (device)
-        m = re.search (regex, out)
-        res = m.group (1) if m is not None else None
-        Log.lsblk.debug ("EFI disk is '%s'", res)
-        return res
+LSBLK_COLUMNS = "NAME,PKNAME,TYPE,MAJ:MIN,MOUNTPOINT,FSTYPE,PARTTYPE,PARTUUID"
+LSBLK_PAIR_REGEX = re.compile (r'([A-Z_:-]+)="((?:[^"\\]|\\.)*)"')
+LSBLK_ESCAPE_REGEX = re.compile (r"\\x([0-9a-fA-F]{2})")
+PARTITION_NUMBER_REGEX = re.compile (r"(\d+)$")
+
+def _unescape (value):
+    return LSBLK_ESCAPE_REGEX.sub (lambda m: chr (int (m.group (1), 16)), value)
 
+def parse_lsblk_pairs (output):
+    disks = []
+    partitions = []
+    for line in output.splitlines ():
+        row = {key.replace ("_", ":"): _unescape (value) for key, value in LSBLK_PAIR_REGEX.findall (line)}
+        if "NAME" not in row:
+            continue
+
+        name = os.path.basename (row["NAME"])
+        if row.get ("TYPE") != "part":
+            disks.append (Disk (name, row["NAME"], row.get ("MAJ:MIN"), ()))
+            continue
+
+        m = PARTITION_NUMBER_REGEX.search (name)
+        mountpoint = row.get ("MOUNTPOINT") or None
+        fstype = row.get ("FSTYPE") or None
+        partitions.append (Partition (
+            name, row["NAME"], os.path.basename (row.get ("PKNAME", "")), int (m.group (1)) if m else None,
+            row.get ("MAJ:MIN"), row.get ("PARTTYPE") or None, row.get ("PARTUUID") or None, fstype,
+            (Mount (mountpoint, fstype, row["NAME"]),) if mountpoint is not None else ()
+        ))
+
+    return DeviceTree.build (disks, partitions)
+
+class LsBlk:
     @staticmethod
-    def get_partition_from_device (device):
-        out = lsblk ("-no", "MAJ:MIN", device)
-        regex = r"\d+:(\d+)"
-        m = re.search (regex, out)
-        res = m.group (1) if m is not None else None
-        Log.lsblk.debug ("EFI partition number on disk is %s", res)
-        return res
+    async def get_device_tree_async ():
+        output = await lsblk_async ("-pnPo", LSBLK_COLUMNS)
+        with Trace.span ("parse lsblk output", "parse"):
+            tree = parse_lsblk_pairs (output)
+        Log.lsblk.debug ("Found %d disks with %d partitions", len (tree.disks), len (tree.partitions))
+        return tree
 
     @staticmethod
-    def get_mountpoint_from_device (device):
-        res = lsblk ("-no", "MOUNTPOINT", device)[:-1]
-        Log.lsblk.debug ("EFI device mountpoint is '%s'", res)
-        return res
+    def get_device_tree ():
+        return run (LsBlk.get_device_tree_async ())
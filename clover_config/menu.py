@@ -0,0 +1,238 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import configparser
+import hashlib
+import json
+import os
+import os.path
+import pkgutil
+import plistlib
+
+from collections import namedtuple, OrderedDict
+
+from clover_config.errors import ConfigError
+from clover_config.fsutil import atomic_write
+
+MENU_CONF_PATH = "/etc/clover/menu.conf"
+MENU_SECTION = "menu"
+MANIFEST_VERSION = 2
+
+# menu.conf entry options and the config.plist keys they are rendered to
+ENTRY_STRING_KEYS = OrderedDict ([
+    ("type", "Type"),
+    ("volume", "Volume"),
+    ("path", "Path"),
+    ("options", "Arguments"),
+    ("image", "Image"),
+    ("hotkey", "Hotkey"),
+])
+ENTRY_BOOLEAN_KEYS = OrderedDict ([
+    ("hidden", "Hidden"),
+    ("disabled", "Disabled"),
+])
+DEFAULT_ENTRY_TYPE = "Linux"
+
+class MenuError (ConfigError):
+    pass
+
+class MenuEntry (namedtuple ("MenuEntry", ["title", "options"])):
+    """
+    A single boot entry of menu.conf. `options` is a tuple of sorted
+    (key, value) pairs so entries can be hashed and compared cheaply.
+    """
+    __slots__ = ()
+
+    def digest (self):
+        return hashlib.sha256 (json.dumps ([self.title, self.options]).encode ()).hexdigest ()
+
+    def render (self):
+        options = dict (self.options)
+        unknown = set (options) - set (ENTRY_STRING_KEYS) - set (ENTRY_BOOLEAN_KEYS)
+        if unknown:
+            raise MenuError ("Unknown option(s) {} in menu entry '{}'".format (
+                ", ".join (sorted (unknown)), self.title
+            ))
+
+        rendered = OrderedDict ([("Title", self.title)])
+        options.setdefault ("type", DEFAULT_ENTRY_TYPE)
+        for key, plist_key in ENTRY_STRING_KEYS.items ():
+            if key in options:
+                rendered[plist_key] = options[key]
+        for key, plist_key in ENTRY_BOOLEAN_KEYS.items ():
+            if key in options:
+                rendered[plist_key] = _parse_boolean (self.title, key, options[key])
+        return rendered
+
+class Menu (namedtuple ("Menu", ["settings", "entries"])):
+    __slots__ = ()
+
+def _parse_boolean (section, key, value):
+    states = configparser.RawConfigParser.BOOLEAN_STATES
+    if value.lower () not in states:
+        raise MenuError ("Option '{}' in section '{}' is not a boolean: {}".format (key, section, value))
+    return states[value.lower ()]
+
+def parse_menu (content, source = MENU_CONF_PATH):
+    parser = configparser.RawConfigParser (default_section = "__none__", interpolation = None)
+    try:
+        parser.read_string (content, source = source)
+    except configparser.Error as e:
+        raise MenuError (str (e))
+
+    settings = {}
+    entries = []
+    for section in parser.sections ():
+        if section == MENU_SECTION:
+            settings = dict (parser.items (section))
+            continue
+        entries.append (MenuEntry (section, tuple (sorted (parser.items (section)))))
+    return Menu (settings, entries)
+
+def load_menu (path = MENU_CONF_PATH):
+    try:
+        with open (path) as f:
+            content = f.read ()
+    except FileNotFoundError:
+        return None
+    return parse_menu (content, path)
+
+def load_base_config ():
+    return pkgutil.get_data ("clover_config", "data/base_config.xml")
+
+class MenuCompiler:
+    """
+    Compile a `Menu` into Clover's config.plist.
+
+    A manifest remembers the digest of every rendered entry and of the last
+    output written to each path. Entries whose digest did not change are
+    reused from the manifest and an output is only rewritten if its content
+    differs from what is already on the EFI partition.
+    """
+
+    def __init__ (self, manifest):
+        self.manifest_path = manifest
+        self.manifest = self._load_manifest ()
+        self._saved_manifest = json.dumps (self.manifest)
+
+    def _load_manifest (self):
+        try:
+            with open (self.manifest_path) as f:
+                manifest = json.load (f, object_pairs_hook = OrderedDict)
+        except (OSError, ValueError):
+            return {"version": MANIFEST_VERSION, "entries": {}, "outputs": {}}
+        if not isinstance (manifest, dict) or manifest.get ("version") != MANIFEST_VERSION:
+            return {"version": MANIFEST_VERSION, "entries": {}, "outputs": {}}
+        return manifest
+
+    def _save_manifest (self):
+        content = json.dumps (self.manifest)
+        if content == self._saved_manifest:
+            return
+        directory = os.path.dirname (self.manifest_path)
+        if not os.path.isdir (directory):
+            os.makedirs (directory)
+        atomic_write (self.manifest_path, content.encode ())
+        self._saved_manifest = content
+
+    def render_entries (self, entries):
+        """
+        Return the rendered entries and the titles of those entries that had
+        to be rendered because they were not found in the manifest.
+        """
+        cached = self.manifest.get ("entries", {})
+        result = OrderedDict ()
+        rendered = []
+        for entry in entries:
+            digest = entry.digest ()
+            if digest not in cached:
+                cached[digest] = entry.render ()
+                rendered.append (entry.title)
+            result[digest] = cached[digest]
+        self.manifest["entries"] = result
+        return list (result.values ()), rendered
+
+    def compile (self, menu, current = None):
+        """
+        Merge `menu` into `current`, the content of an existing config.plist,
+        or into Clover's default configuration if there is none. Only the
+        custom entries and the settings given in menu.conf are replaced, so
+        hardware specific settings like ACPI or SMBIOS survive. Returns
+        `current` itself if the merge does not change anything.
+        """
+        try:
+            config = plistlib.loads (current if current is not None else load_base_config (),
+                                     dict_type = OrderedDict)
+        except Exception as e:
+            # plistlib raises ValueError, InvalidFileException or the errors of the XML parser
+            raise MenuError ("Cannot parse the existing config.plist: {}".format (e))
+        if not isinstance (config, dict):
+            raise MenuError ("The existing config.plist does not contain a dictionary")
+        entries, rendered = self.render_entries (menu.entries)
+
+        boot = config.setdefault ("Boot", OrderedDict ())
+        gui = config.setdefault ("GUI", OrderedDict ())
+        if "timeout" in menu.settings:
+            try:
+                boot["Timeout"] = int (menu.settings["timeout"])
+            except ValueError:
+                raise MenuError ("Option 'timeout' in section '{}' is not a number".format (MENU_SECTION))
+        if "default" in menu.settings:
+            boot["DefaultVolume"] = menu.settings["default"]
+        if "theme" in menu.settings:
+            gui["Theme"] = menu.settings["theme"]
+        gui.setdefault ("Custom", OrderedDict ())["Entries"] = entries
+
+        data = plistlib.dumps (config, sort_keys = False)
+        # a config.plist written by hand need not look like plistlib's output, leave it alone
+        # as long as it has the same content, regardless of the order of the keys
+        if current is not None and plistlib.loads (data) == plistlib.loads (current):
+            return current, rendered
+        return data, rendered
+
+    def is_up_to_date (self, output, data):
+        digest = hashlib.sha256 (data).hexdigest ()
+        record = self.manifest.get ("outputs", {}).get (output)
+        try:
+            stat = os.stat (output)
+        except FileNotFoundError:
+            return False
+
+        # trust the manifest if the file on the EFI partition was not touched since we wrote it
+        if (record is not None and record.get ("digest") == digest and
+                record.get ("size") == stat.st_size and record.get ("mtime") == stat.st_mtime_ns):
+            return True
+
+        with open (output, "rb") as f:
+            return hashlib.sha256 (f.read ()).hexdigest () == digest
+
+    def write (self, output, data):
+        directory = os.path.dirname (output)
+        if not os.path.isdir (directory):
+            os.makedirs (directory)
+        atomic_write (output, data)
+        self.record_output (output, data)
+
+    def record_output (self, output, data):
+        stat = os.stat (output)
+        self.manifest.setdefault ("outputs", {})[output] = {
+            "digest": hashlib.sha256 (data).hexdigest (),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+        }
+        self._save_manifest ()
@@ -0,0 +1,363 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import logging
+import os
+import os.path
+
+from collections import namedtuple
+
+from clover_config.blockdev import ESP
+from clover_config.bootstate import BootEntry, BootState
+from clover_config.config import CONFIG_PATH, ConfigLoader
+from clover_config.errors import CloverConfigError, ConfigError, NoEFIDeviceError
+from clover_config.log import Log
+from clover_config.paths import SYSFS_PATH, MOUNTINFO_PATH, UDEV_DATA_PATH, DEV_DISK_PATH
+
+# all paths below are relative to the root of a target
+FSTAB_PATH = "/etc/fstab"
+NVRAM_MANIFEST_PATH = "/var/lib/clover-config/nvram.json"
+MENU_MANIFEST_PATH = "/var/cache/clover-config/menu-manifest.json"
+# where distributions mount the EFI partition, in order of preference
+ESP_MOUNTPOINTS = ("/boot/efi", "/efi", "/boot")
+ESP_FSTYPE = "vfat"
+# the udev symlinks for the fstab specs naming a device by a property
+SPEC_LINKS = {"UUID": "by-uuid", "LABEL": "by-label", "PARTUUID": "by-partuuid", "PARTLABEL": "by-partlabel"}
+MANIFEST_VERSION = 1
+# actions that do not need the firmware of the running system
+OFFLINE_ACTIONS = ("status", "install", "remove", "update")
+LOG_FORMAT = "{asctime} [{name:<15.15}] [{levelname:<8.8}]: {message}"
+
+class FstabEntry (namedtuple ("FstabEntry", ["spec", "mountpoint", "fstype"])):
+    __slots__ = ()
+
+class TargetResult (namedtuple ("TargetResult", ["root", "results", "error", "exit_code", "log"])):
+    """
+    The outcome of running actions on a target. `results` holds an
+    (action, result) pair per finished action, `error` and `exit_code` are
+    set if an action failed and `log` is the path of the target's log.
+    """
+    __slots__ = ()
+
+def in_root (root, path):
+    return os.path.join (root, path.lstrip ("/"))
+
+def parse_fstab (content):
+    from clover_config.sysblock import MOUNTINFO_ESCAPE_REGEX
+
+    entries = []
+    for line in content.splitlines ():
+        fields = line.split ()
+        if len (fields) < 3 or fields[0].startswith ("#"):
+            continue
+        mountpoint = MOUNTINFO_ESCAPE_REGEX.sub (lambda m: chr (int (m.group (1), 8)), fields[1])
+        entries.append (FstabEntry (fields[0], os.path.normpath (mountpoint), fields[2]))
+    return entries
+
+class TargetConfig:
+    """
+    The settings of a target, read from its own configuration files. The
+    configured paths point into the target.
+    """
+
+    def __init__ (self, root):
+        try:
+            values = ConfigLoader (in_root (root, CONFIG_PATH)).load ()
+        except ConfigError as e:
+            raise ConfigError ("Invalid configuration of '{}': {}".format (root, e))
+
+        for name, value in values.items ():
+            setattr (self, name, value)
+        self.MenuFile = in_root (root, self.MenuFile)
+        self.PayloadDir = in_root (root, self.PayloadDir)
+        self.KernelDirs = [in_root (root, directory) for directory in self.KernelDirs]
+
+class OfflineBootManager:
+    """
+    A stand-in for `BootManager` operating on a disk image or directory
+    tree instead of the running system.
+
+    The EFI partitions are taken from the fstab of the target. If the image
+    is loop mounted, the partitions are looked up on the host, by their
+    mountpoint or their fstab spec, to learn their disk, number and
+    partition UUID. Boot entries are never written to the firmware but
+    recorded in an NVRAM manifest inside the target, along with the fstab
+    spec and mountpoint of their partition, so they can be registered on
+    the first boot of the image.
+    """
+
+    def __init__ (self, root, manifest = None, sysfs = SYSFS_PATH, mountinfo = MOUNTINFO_PATH,
+                  udev = UDEV_DATA_PATH, dev_disk = DEV_DISK_PATH):
+        self.root = os.path.realpath (root)
+        self.manifest = manifest if manifest is not None else in_root (self.root, NVRAM_MANIFEST_PATH)
+        self.SysFSRoot = sysfs
+        self.MountInfoPath = mountinfo
+        self.UdevDataPath = udev
+        self.DevDiskPath = dev_disk
+        self._esps = None
+        self._specs = {}
+        self._nvram = None
+
+    def get_fstab (self):
+        try:
+            with open (in_root (self.root, FSTAB_PATH)) as f:
+                return parse_fstab (f.read ())
+        except FileNotFoundError:
+            return []
+
+    def get_device_tree (self):
+        from clover_config.blockdev import DeviceTree
+        from clover_config.sysblock import SysBlock
+
+        sysblock = SysBlock (self.SysFSRoot, self.MountInfoPath, self.UdevDataPath)
+        if not sysblock.available ():
+            return DeviceTree (())
+        return sysblock.get_device_tree ()
+
+    def _find_esp_mounts (self):
+        fstab = [entry for entry in self.get_fstab ()
+                 if entry.fstype == ESP_FSTYPE and entry.mountpoint in ESP_MOUNTPOINTS]
+        if fstab:
+            return [(entry.spec, entry.mountpoint) for entry in fstab]
+        # without an fstab entry any of the usual mountpoints holding an EFI directory will do
+        return [(None, mountpoint) for mountpoint in ESP_MOUNTPOINTS
+                if os.path.isdir (os.path.join (in_root (self.root, mountpoint), "EFI"))]
+
+    def _find_partition (self, tree, spec, path):
+        """
+        Look up the partition mounted at `path` or named by the fstab `spec`
+        on the host.
+        """
+        part = tree.get_by_mountpoint (path)
+        if part is not None or spec is None:
+            return part
+        key, _, value = spec.partition ("=")
+        if key == "PARTUUID":
+            part = next ((part for part in tree.partitions.values ()
+                          if part.partuuid is not None and part.partuuid.lower () == value.lower ()), None)
+            if part is not None:
+                return part
+        device = os.path.join (self.DevDiskPath, SPEC_LINKS[key], value) if key in SPEC_LINKS else spec
+        return tree.get (os.path.realpath (device)) if device.startswith ("/") else None
+
+    def get_esps (self):
+        if self._esps is not None:
+            return self._esps
+
+        tree = self.get_device_tree ()
+        esps = []
+        specs = {}
+        for spec, mountpoint in self._find_esp_mounts ():
+            path = in_root (self.root, mountpoint)
+            if not os.path.isdir (path):
+                Log.offline.warning ("EFI partition mountpoint '%s' of '%s' does not exist.", mountpoint, self.root)
+                continue
+
+            specs[path] = spec
+            part = self._find_partition (tree, spec, path)
+            if part is not None:
+                esps.append (ESP (part.device, tree.get_disk (part).device, str (part.number), path, part.partuuid))
+                continue
+            partuuid = spec[len ("PARTUUID="):] if spec is not None and spec.startswith ("PARTUUID=") else None
+            esps.append (ESP (spec or mountpoint, None, None, path, partuuid))
+
+        if len (esps) == 0:
+            raise NoEFIDeviceError ("No EFI partition found in '{}'!".format (self.root))
+        self._esps = esps
+        self._specs = specs
+        return esps
+
+    def _load_nvram (self):
+        if self._nvram is not None:
+            return self._nvram
+        try:
+            with open (self.manifest) as f:
+                nvram = json.load (f)
+        except FileNotFoundError:
+            nvram = None
+        except (OSError, ValueError) as e:
+            raise ConfigError ("Cannot read NVRAM manifest '{}': {}".format (self.manifest, e))
+        if not isinstance (nvram, dict) or nvram.get ("version") != MANIFEST_VERSION:
+            nvram = {"version": MANIFEST_VERSION, "entries": [], "boot_order": []}
+        self._nvram = nvram
+        return nvram
+
+    def _save_nvram (self):
+        from clover_config.fsutil import atomic_write
+
+        directory = os.path.dirname (self.manifest)
+        if not os.path.isdir (directory):
+            os.makedirs (directory)
+        atomic_write (self.manifest, json.dumps (self._nvram, indent = 2, sort_keys = True).encode ())
+
+    @staticmethod
+    def _device_path (entry):
+        # mimic the device path efibootmgr prints, without a partition UUID there is no hard drive node
+        if entry["partuuid"] is None:
+            return "File({})".format (entry["loader"])
+        return "HD({},GPT,{},0x0,0x0)/File({})".format (entry["partition"] or 0, entry["partuuid"], entry["loader"])
+
+    def get_boot_state (self):
+        nvram = self._load_nvram ()
+        return BootState.from_entries (
+            (BootEntry (entry["bootnum"], entry["label"], entry["active"], self._device_path (entry))
+             for entry in nvram["entries"]),
+            nvram["boot_order"]
+        )
+
+    def entry_matches (self, entry, desired):
+        """
+        Compare the recorded fields of the entry, as the partition UUID may
+        be unknown for an image that is not loop mounted.
+        """
+        from clover_config.plan import normalize_loader
+
+        recorded = next ((recorded for recorded in self._load_nvram ()["entries"]
+                          if recorded["bootnum"] == entry.bootnum), None)
+        if recorded is None:
+            return False
+        partuuid = recorded["partuuid"].lower () if recorded["partuuid"] is not None else None
+        return (normalize_loader (recorded["loader"]) == normalize_loader (desired.loader) and
+                partuuid == (desired.partuuid.lower () if desired.partuuid is not None else None) and
+                recorded["partition"] == desired.partition and recorded["disk"] == desired.disk)
+
+    def read_boot_state (self):
+        # the manifest does not depend on the EFI partitions of the target
+        return self.get_boot_state ()
+
+    def apply (self, operations):
+        from clover_config.plan import REMOVE, CREATE, ACTIVATE, ORDER
+
+        nvram = self._load_nvram ()
+        entries = {entry["bootnum"]: entry for entry in nvram["entries"]}
+        boot_order = list (nvram["boot_order"])
+        for operation in operations:
+            if operation.kind == REMOVE:
+                entries.pop (operation.bootnum, None)
+                boot_order = [num for num in boot_order if num != operation.bootnum]
+            elif operation.kind == CREATE:
+                bootnum = next ("{:04X}".format (i) for i in range (0x10000) if "{:04X}".format (i) not in entries)
+                desired = operation.entry
+                esp = next ((esp for esp in self.get_esps () if
+                             (esp.disk, esp.partition, esp.partuuid) ==
+                             (desired.disk, desired.partition, desired.partuuid)), None)
+                entries[bootnum] = {
+                    "bootnum": bootnum, "label": desired.label, "active": True, "loader": desired.loader,
+                    # the device of a loop mounted image is only valid on the host, the spec and
+                    # mountpoint from the fstab are what identifies the partition on first boot
+                    "device": esp.device if esp is not None and esp.disk is not None else None,
+                    "spec": self._specs.get (esp.mountpoint) if esp is not None else None,
+                    "mountpoint": "/" + os.path.relpath (esp.mountpoint, self.root) if esp is not None else None,
+                    "disk": desired.disk, "partition": desired.partition, "partuuid": desired.partuuid,
+                }
+                # like efibootmgr -c the new entry goes first
+                boot_order.insert (0, bootnum)
+            elif operation.kind == ACTIVATE:
+                entries[operation.bootnum]["active"] = True
+            elif operation.kind == ORDER:
+                boot_order = list (operation.boot_order)
+
+        nvram["entries"] = sorted (entries.values (), key = lambda entry: entry["bootnum"])
+        nvram["boot_order"] = boot_order
+        self._save_nvram ()
+
+    def check_efi (self):
+        # the target is not booted, so there is no firmware to check
+        pass
+
+    def invalidate (self):
+        self._nvram = None
+
+    def reset (self):
+        self._esps = None
+        self._specs = {}
+        self._nvram = None
+
+def get_log_path (log_dir, root):
+    name = os.path.normpath (os.path.abspath (root)).strip ("/").replace ("/", "_") or "root"
+    return os.path.join (log_dir, name + ".log")
+
+def run_target (root, actions, dry_run = False, log_dir = ".", log_level = logging.INFO):
+    """
+    Run `actions` on the target at `root`, logging to a file of its own in
+    `log_dir`, and return a `TargetResult`. Stops at the first failing
+    action.
+    """
+    from clover_config.api import CloverConfig
+    from clover_config.lock import NoLock
+
+    log = get_log_path (log_dir, root)
+    handler = logging.FileHandler (log, mode = "w")
+    handler.setLevel (log_level)
+    handler.setFormatter (logging.Formatter (LOG_FORMAT, style = "{"))
+    logger = logging.getLogger ()
+    level = logger.level
+    # the console only shows a summary per target, the details go to the target's log alone
+    handlers = list (logger.handlers)
+    for other in handlers:
+        logger.removeHandler (other)
+    logger.setLevel (min (level, log_level))
+    logger.addHandler (handler)
+
+    results = []
+    try:
+        manager = OfflineBootManager (root)
+        # targets are not shared with other processes like the running system is
+        clover = CloverConfig (manager, TargetConfig (manager.root), kernel_cache = None, root = manager.root,
+                               manifest = in_root (manager.root, MENU_MANIFEST_PATH), lock = NoLock ())
+        operations = {
+            "status": clover.status,
+            "install": lambda: clover.install (dry_run),
+            "remove": lambda: clover.remove (dry_run),
+            "update": lambda: clover.update (dry_run),
+        }
+        for action in actions:
+            Log.offline.info ("Running %s on '%s'...", action, manager.root)
+            results.append ((action, operations[action] ()))
+    except CloverConfigError as e:
+        Log.offline.error ("%s", e)
+        return TargetResult (root, tuple (results), str (e), e.exit_code, log)
+    finally:
+        logger.removeHandler (handler)
+        for other in handlers:
+            logger.addHandler (other)
+        logger.setLevel (level)
+        handler.close ()
+    return TargetResult (root, tuple (results), None, None, log)
+
+def run_targets (roots, actions, jobs = 1, dry_run = False, log_dir = ".", log_level = logging.INFO):
+    """
+    Run `actions` on every target and yield their `TargetResult`s in
+    order. With more than one job the targets are processed by a pool of
+    processes, each writing its own log only.
+    """
+    from functools import partial
+
+    run = partial (run_target, actions = actions, dry_run = dry_run, log_dir = log_dir, log_level = log_level)
+    if jobs <= 1 or len (roots) <= 1:
+        for root in roots:
+            yield run (root)
+        return
+
+    import multiprocessing
+
+    # forking would copy the threads and handlers of the console logging into the workers
+    with multiprocessing.get_context ("spawn").Pool (min (jobs, len (roots))) as pool:
+        for result in pool.imap (run, roots):
+            yield result
@@ -0,0 +1,53 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import os.path
+
+# kept free of heavy imports so that everything can refer to these defaults
+# without pulling in the modules implementing the actual discovery
+
+EFI_FIRMWARE_PATH = "/sys/firmware/efi"
+EFIVARS_PATH = "/sys/firmware/efi/efivars"
+SYSFS_PATH = "/sys"
+MOUNTINFO_PATH = "/proc/self/mountinfo"
+UDEV_DATA_PATH = "/run/udev/data"
+DEV_DISK_PATH = "/dev/disk"
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+SOCKET_PATH = "/run/clover-config.sock"
+LOCK_PATH = "/run/clover-config.lock"
+
+def get_cache_dir ():
+    if os.geteuid () == 0:
+        return "/var/cache/clover-config"
+    base = os.environ.get ("XDG_CACHE_HOME") or os.path.join (os.path.expanduser ("~"), ".cache")
+    return os.path.join (base, "clover-config")
+
+def _get_runtime_path (name, system_path):
+    if os.geteuid () == 0:
+        return system_path
+    runtime = os.environ.get ("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join (runtime, name)
+    return os.path.join (get_cache_dir (), name)
+
+def get_socket_path ():
+    return _get_runtime_path ("clover-config.sock", SOCKET_PATH)
+
+def get_lock_path ():
+    return _get_runtime_path ("clover-config.lock", LOCK_PATH)
@@ -0,0 +1,193 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import os
+import os.path
+import re
+
+from collections import namedtuple
+
+from clover_config.log import Log
+from clover_config.errors import PayloadError
+from clover_config.fsutil import create_temporary, sync_filesystem
+from clover_config.trace import Trace
+
+# hashing and copying is bound by I/O, so use more threads than cores
+WORKERS = 8
+CHUNK_SIZE = 1024 * 1024
+LOADER_PATH = os.path.join ("EFI", "CLOVER", "CLOVERX64.efi")
+# Clover embeds its revision in the loader, either as ASCII or as UTF-16 string
+REVISION_PREFIX = "Clover revision: "
+REVISION_REGEXES = (
+    re.compile (re.escape (REVISION_PREFIX.encode ()) + rb"(\d+)"),
+    re.compile (re.escape (REVISION_PREFIX.encode ("utf-16-le")) + rb"((?:\d\x00)+)"),
+)
+
+class SyncResult (namedtuple ("SyncResult", ["source", "destination", "files", "copied", "written"])):
+    """
+    The outcome of a payload synchronization. `files` is the number of
+    files in the payload and `copied` the relative paths of those that
+    differed on the EFI partition.
+    """
+    __slots__ = ()
+
+def hash_file (path):
+    digest = hashlib.sha256 ()
+    with open (path, "rb") as f:
+        for chunk in iter (lambda: f.read (CHUNK_SIZE), b""):
+            digest.update (chunk)
+    return digest.hexdigest ()
+
+def get_payload_version (root):
+    """
+    The version of the Clover payload below `root`: the revision embedded
+    in the loader as `r<revision>` or, if it has none, an abbreviated
+    digest of the loader. None if there is no loader.
+    """
+    try:
+        with open (os.path.join (root, LOADER_PATH), "rb") as f:
+            loader = f.read ()
+    except OSError:
+        return None
+
+    for regex in REVISION_REGEXES:
+        match = regex.search (loader)
+        if match is not None:
+            return "r" + match.group (1).replace (b"\0", b"").decode ()
+    return hashlib.sha256 (loader).hexdigest ()[:12]
+
+def _discard (temporaries):
+    for temporary in temporaries:
+        try:
+            os.unlink (temporary)
+        except OSError as e:
+            Log.payload.warning ("Cannot remove temporary file '%s': %s", temporary, e)
+
+def list_files (root, exclude = ()):
+    """
+    Return the paths of all files below `root` relative to it, except for
+    those listed in `exclude`.
+    """
+    files = []
+    for directory, dirnames, filenames in os.walk (root):
+        dirnames.sort ()
+        for name in sorted (filenames):
+            relative = os.path.relpath (os.path.join (directory, name), root)
+            if relative not in exclude:
+                files.append (relative)
+    return files
+
+class PayloadSync:
+    """
+    Copy a payload tree onto the EFI partition.
+
+    Source and destination files are compared on a thread pool, by size
+    first and by content hash if the sizes match. Only differing files are
+    copied, each into a temporary file next to its destination. All copies
+    are flushed with one filesystem sync before they are renamed into
+    place and a second one makes the renames durable, so a crash leaves
+    every file either old or new and FAT is not synced once per file.
+    """
+
+    def __init__ (self, source, destination, exclude = (), workers = WORKERS):
+        self.source = source
+        self.destination = destination
+        self.exclude = exclude
+        self.workers = workers
+
+    def _differs (self, relative):
+        source = os.path.join (self.source, relative)
+        destination = os.path.join (self.destination, relative)
+        try:
+            stat = os.stat (destination)
+        except FileNotFoundError:
+            return True
+        if os.stat (source).st_size != stat.st_size:
+            return True
+        return hash_file (source) != hash_file (destination)
+
+    def _copy (self, relative):
+        source = os.path.join (self.source, relative)
+        directory = os.path.dirname (os.path.join (self.destination, relative))
+        os.makedirs (directory, exist_ok = True)
+
+        digest = hashlib.sha256 ()
+        fd, temporary = create_temporary (directory)
+        try:
+            with os.fdopen (fd, "wb") as out, open (source, "rb") as f:
+                for chunk in iter (lambda: f.read (CHUNK_SIZE), b""):
+                    digest.update (chunk)
+                    out.write (chunk)
+        except BaseException:
+            os.unlink (temporary)
+            raise
+        return temporary, digest.hexdigest ()
+
+    def _verify (self, relative, digest):
+        return hash_file (os.path.join (self.destination, relative)) == digest
+
+    def sync (self, dry_run = False):
+        from concurrent.futures import ThreadPoolExecutor
+
+        files = list_files (self.source, self.exclude)
+        with ThreadPoolExecutor (max_workers = self.workers) as executor:
+            with Trace.span ("compare payload", "payload", files = len (files)):
+                changed = [relative for relative, differs in zip (files, executor.map (self._differs, files))
+                           if differs]
+            Log.payload.debug ("%d of %d payload files differ on '%s'", len (changed), len (files), self.destination)
+
+            if len (changed) == 0 or dry_run:
+                return SyncResult (self.source, self.destination, len (files), tuple (changed), False)
+
+            with Trace.span ("copy payload", "payload", files = len (changed)):
+                futures = [(relative, executor.submit (self._copy, relative)) for relative in changed]
+                copies = []
+                error = None
+                # wait for every copy, so no temporary file is left behind on failure
+                for relative, future in futures:
+                    try:
+                        copies.append ((relative,) + future.result ())
+                    except Exception as e:
+                        error = error or e
+                if error is not None:
+                    _discard (temporary for _, temporary, _ in copies)
+                    raise error
+
+            with Trace.span ("commit payload", "payload"):
+                committed = 0
+                try:
+                    sync_filesystem (self.destination)
+                    for relative, temporary, _ in copies:
+                        os.replace (temporary, os.path.join (self.destination, relative))
+                        committed += 1
+                    sync_filesystem (self.destination)
+                except BaseException:
+                    # the files renamed so far are complete, the others must not stay behind
+                    _discard (temporary for _, temporary, _ in copies[committed:])
+                    raise
+
+            with Trace.span ("verify payload", "payload"):
+                verified = executor.map (lambda copy: self._verify (copy[0], copy[2]), copies)
+                corrupted = [copy[0] for copy, ok in zip (copies, verified) if not ok]
+            if corrupted:
+                raise PayloadError ("Verification of {} on '{}' failed".format (
+                    ", ".join (corrupted), self.destination
+                ))
+
+        return SyncResult (self.source, self.destination, len (files), tuple (changed), True)
@@ -0,0 +1,158 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+
+from collections import namedtuple
+
+HARDDRIVE_REGEX = re.compile (r"HD\((\d+),(?:GPT|MBR),([^,]+),")
+FILE_REGEX = re.compile (r"File\(([^)]*)\)")
+# GPT partition UUIDs and the disk signature and partition number MBR uses instead
+PARTUUID_REGEX = re.compile (r"[0-9a-f]{8}-(?:[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{2})",
+                             re.IGNORECASE)
+
+REMOVE = "remove"
+CREATE = "create"
+ACTIVATE = "activate"
+ORDER = "order"
+
+class DesiredEntry (namedtuple ("DesiredEntry", ["label", "loader", "disk", "partition", "partuuid", "default"])):
+    __slots__ = ()
+
+class Operation (namedtuple ("Operation", ["kind", "bootnum", "entry", "boot_order"])):
+    __slots__ = ()
+
+    def __str__ (self):
+        if self.kind == REMOVE:
+            return "remove boot entry Boot{}".format (self.bootnum)
+        if self.kind == CREATE:
+            return "create boot entry '{}' for {} on {} partition {}".format (
+                self.entry.label, self.entry.loader, self.entry.disk, self.entry.partition
+            )
+        if self.kind == ACTIVATE:
+            return "activate boot entry Boot{}".format (self.bootnum)
+        return "set boot order to {}".format (",".join (self.boot_order))
+
+def normalize_loader (loader):
+    # FAT is case insensitive and efibootmgr accepts both path separators
+    return loader.replace ("/", "\\").lower ()
+
+def entry_matches (entry, desired):
+    """
+    Check whether an existing `BootEntry` already points to the desired
+    loader on the desired partition.
+    """
+    if entry.device_path is None:
+        return False
+
+    hd = HARDDRIVE_REGEX.search (entry.device_path)
+    loader = FILE_REGEX.search (entry.device_path)
+    if hd is None or loader is None:
+        return False
+
+    # the device path does not name the disk, so without the partition UUID an entry
+    # for the same partition number on any other disk would match
+    if desired.partuuid is None or hd.group (2).lower () != desired.partuuid.lower ():
+        return False
+    if desired.partition is not None and hd.group (1) != str (desired.partition):
+        return False
+    return normalize_loader (loader.group (1)) == normalize_loader (desired.loader)
+
+def mirror_label (label, identifier):
+    """
+    The label of the boot entry for an additional EFI partition.
+    """
+    return "{} ({})".format (label, identifier)
+
+def is_mirror_label (candidate, label, known = ()):
+    """
+    Tell whether `candidate` is the label of an additional EFI partition:
+    one of the `known` labels of the discovered partitions, or `label`
+    followed by a partition UUID as used for partitions no longer mounted.
+    """
+    if candidate in known:
+        return True
+    prefix = label + " ("
+    if not candidate.startswith (prefix) or not candidate.endswith (")"):
+        return False
+    return PARTUUID_REGEX.fullmatch (candidate[len (prefix):-1]) is not None
+
+def _labelled (state, label, mirrors = False, known = ()):
+    # entries listed in the boot order come first so we keep the one the firmware prefers
+    position = {bootnum: i for i, bootnum in enumerate (state.boot_order)}
+    return sorted (
+        (entry for entry in state.entries.values ()
+         if entry.label == label or (mirrors and is_mirror_label (entry.label, label, known))),
+        key = lambda entry: (position.get (entry.bootnum, len (position)), entry.bootnum)
+    )
+
+def plan_install (state, desired):
+    """
+    Compute the smallest ordered list of operations that turns `state` into
+    a state with exactly one active entry matching `desired`.
+    """
+    return plan_install_all (state, [desired])
+
+def plan_install_all (state, entries, matches = entry_matches):
+    """
+    Like `plan_install` for several desired entries with distinct labels,
+    e.g. one per mirrored EFI partition. If they should be the default,
+    they are moved to the front of the boot order in the given order.
+    `matches` tells whether an existing entry can be kept for a desired one.
+    """
+    removals = []
+    creations = []
+    activations = []
+    kept = []
+    for desired in entries:
+        keep = None
+        for entry in _labelled (state, desired.label):
+            if keep is None and matches (entry, desired):
+                keep = entry
+            else:
+                removals.append (Operation (REMOVE, entry.bootnum, None, None))
+
+        if keep is None:
+            creations.append (Operation (CREATE, None, desired, None))
+            continue
+        kept.append (keep.bootnum)
+        if not keep.active:
+            activations.append (Operation (ACTIVATE, keep.bootnum, None, None))
+
+    # efibootmgr -c prepends the new entry to BootOrder on its own, so the
+    # first entry has to be created last
+    operations = removals + creations[::-1] + activations
+    if creations:
+        return operations
+
+    default = any (desired.default for desired in entries)
+    if default and tuple (state.boot_order[:len (kept)]) != tuple (kept):
+        removed = {op.bootnum for op in removals}
+        rest = tuple (num for num in state.boot_order if num not in kept and num not in removed)
+        operations.append (Operation (ORDER, None, None, tuple (kept) + rest))
+
+    return operations
+
+def plan_remove (state, label, known = ()):
+    """
+    Remove all entries carrying `label`, including those of additional EFI
+    partitions that may not be mounted anymore. `known` holds the labels
+    of the additional partitions discovered.
+    """
+    return [Operation (REMOVE, entry.bootnum, None, None)
+            for entry in _labelled (state, label, mirrors = True, known = known)]
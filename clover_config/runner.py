@@ -0,0 +1,93 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import sys
+import threading
+
+from collections import namedtuple
+
+from clover_config.trace import Trace
+
+# every thread runs coroutines on a loop of its own
+_local = threading.local ()
+# runs the coroutines of callers that are already inside an event loop
+_executor = None
+
+class CommandResult (namedtuple ("CommandResult", ["returncode", "out", "err"])):
+    __slots__ = ()
+
+def get_loop ():
+    loop = getattr (_local, "loop", None)
+    if loop is None or loop.is_closed ():
+        loop = asyncio.new_event_loop ()
+        if sys.version_info < (3, 8):
+            # child watchers of older python versions only work with the current loop
+            asyncio.set_event_loop (loop)
+        _local.loop = loop
+    return loop
+
+def _get_running_loop ():
+    get_running_loop = getattr (asyncio, "get_running_loop", None)
+    if get_running_loop is None:
+        return asyncio._get_running_loop ()
+    try:
+        return get_running_loop ()
+    except RuntimeError:
+        return None
+
+async def run_command (executable, *parameters):
+    """
+    Run an external command without blocking the event loop. Raises
+    `FileNotFoundError` if the executable does not exist.
+    """
+    with Trace.span (executable, "subprocess", parameters = " ".join (parameters)):
+        process = await asyncio.create_subprocess_exec (
+            executable, *parameters, stdout = asyncio.subprocess.PIPE, stderr = asyncio.subprocess.PIPE
+        )
+        out, err = await process.communicate ()
+    return CommandResult (process.returncode, out, err)
+
+async def run_in_thread (function, *args):
+    return await get_loop ().run_in_executor (None, function, *args)
+
+def run (coroutine):
+    """
+    Run `coroutine` to completion and return its result. Callers inside a
+    running event loop, like applications embedding the API, block until a
+    worker thread ran it, as loops cannot be nested.
+    """
+    global _executor
+
+    if _get_running_loop () is None:
+        return get_loop ().run_until_complete (coroutine)
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor (1)
+    return _executor.submit (run, coroutine).result ()
+
+def run_concurrently (*coroutines):
+    """
+    Run independent coroutines concurrently and return their results in the
+    order they were given.
+    """
+    async def gather ():
+        return await asyncio.gather (*coroutines)
+    return run (gather ())
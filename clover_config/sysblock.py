@@ -0,0 +1,122 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import os.path
+import re
+
+from clover_config.blockdev import Mount, Partition, Disk, DeviceTree
+from clover_config.paths import SYSFS_PATH, MOUNTINFO_PATH, UDEV_DATA_PATH
+
+MOUNTINFO_ESCAPE_REGEX = re.compile (r"\\([0-7]{3})")
+
+def _unescape (field):
+    return MOUNTINFO_ESCAPE_REGEX.sub (lambda m: chr (int (m.group (1), 8)), field)
+
+def _read (path):
+    try:
+        with open (path) as f:
+            return f.read ().strip ()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+def _parent_name (path):
+    # /sys/class/block/<name> links into the device hierarchy where a partition
+    # lives in the directory of its disk; reading the link is much cheaper
+    # than resolving the whole path
+    try:
+        target = os.readlink (path)
+    except OSError:
+        target = os.path.realpath (path)
+    return os.path.basename (os.path.dirname (target))
+
+def parse_mountinfo (content):
+    """
+    Map `major:minor` device numbers to the list of their mounts.
+    """
+    mounts = {}
+    for line in content.splitlines ():
+        fields = line.split ()
+        try:
+            separator = fields.index ("-", 6)
+        except ValueError:
+            continue
+        if len (fields) < separator + 3:
+            continue
+        mounts.setdefault (fields[2], []).append (
+            Mount (_unescape (fields[4]), fields[separator + 1], _unescape (fields[separator + 2]))
+        )
+    return mounts
+
+def parse_udev_data (content):
+    properties = {}
+    for line in content.splitlines ():
+        if line.startswith ("E:"):
+            key, _, value = line[2:].partition ("=")
+            properties[key] = value
+    return properties
+
+class SysBlock:
+    """
+    Discover all block devices with one pass over sysfs, the mount table
+    and the udev database instead of asking `lsblk` once per property.
+    """
+
+    def __init__ (self, sysfs = SYSFS_PATH, mountinfo = MOUNTINFO_PATH, udev = UDEV_DATA_PATH):
+        self.sysfs = sysfs
+        self.mountinfo = mountinfo
+        self.udev = udev
+
+    @property
+    def class_block (self):
+        return os.path.join (self.sysfs, "class", "block")
+
+    def available (self):
+        # without the udev database we cannot tell partition types apart
+        return os.path.isdir (self.class_block) and os.path.isdir (self.udev)
+
+    def get_device_tree (self):
+        with open (self.mountinfo) as f:
+            mounts = parse_mountinfo (f.read ())
+
+        disks = []
+        partitions = []
+        for name in os.listdir (self.class_block):
+            path = os.path.join (self.class_block, name)
+            devno = _read (os.path.join (path, "dev"))
+            device = "/dev/" + name.replace ("!", "/")
+            number = _read (os.path.join (path, "partition"))
+
+            if number is None:
+                disks.append (Disk (name, device, devno, ()))
+                continue
+
+            udev = _read (os.path.join (self.udev, "b" + devno)) if devno is not None else None
+            properties = parse_udev_data (udev) if udev is not None else {}
+            device_mounts = tuple (mounts.get (devno, ()))
+            fstype = properties.get ("ID_FS_TYPE")
+            if fstype is None and device_mounts:
+                fstype = device_mounts[0].fstype
+
+            partitions.append (Partition (
+                name, device, _parent_name (path), int (number),
+                devno, properties.get ("ID_PART_ENTRY_TYPE"), properties.get ("ID_PART_ENTRY_UUID"),
+                fstype, device_mounts
+            ))
+
+        return DeviceTree.build (disks, partitions)
@@ -0,0 +1,135 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import threading
+import time
+
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+
+class _NullSpan:
+    """
+    The context manager handed out while tracing is disabled.
+    """
+    __slots__ = ()
+
+    def __enter__ (self):
+        return None
+
+    def __exit__ (self, *exc_info):
+        return False
+
+NULL_SPAN = _NullSpan ()
+
+class Span (namedtuple ("Span", ["name", "category", "start", "duration", "track", "args"])):
+    __slots__ = ()
+
+def _current_track ():
+    # coroutines running concurrently on one thread get a track of their own
+    asyncio = sys.modules.get ("asyncio")
+    if asyncio is not None:
+        try:
+            current_task = getattr (asyncio, "current_task", None) or asyncio.Task.current_task
+            task = current_task ()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            return ("task", id (task))
+    return ("thread", threading.get_ident ())
+
+class Tracer:
+    """
+    A lightweight span recorder. While disabled, `span` returns a shared
+    context manager doing nothing, so instrumentation can stay in place
+    permanently.
+    """
+
+    def __init__ (self):
+        self.enabled = False
+        self.spans = []
+        self._origin = time.perf_counter ()
+        self._lock = threading.Lock ()
+
+    def enable (self):
+        self.enabled = True
+
+    def span (self, name, category = "clover-config", **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return self._span (name, category, args)
+
+    @contextmanager
+    def _span (self, name, category, args):
+        track = _current_track ()
+        start = time.perf_counter ()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter () - start
+            with self._lock:
+                self.spans.append (Span (name, category, start - self._origin, duration, track, args))
+
+    def summary (self):
+        """
+        Aggregate the recorded spans into count, total, minimum and maximum
+        duration per (category, name), slowest total first.
+        """
+        stats = OrderedDict ()
+        for span in self.spans:
+            key = (span.category, span.name)
+            count, total, low, high = stats.get (key, (0, 0.0, float ("inf"), 0.0))
+            stats[key] = (count + 1, total + span.duration, min (low, span.duration), max (high, span.duration))
+        return sorted (stats.items (), key = lambda item: item[1][1], reverse = True)
+
+    def format_summary (self):
+        lines = ["{:<12} {:<40} {:>6} {:>10} {:>10} {:>10}".format (
+            "category", "span", "count", "total ms", "min ms", "max ms"
+        )]
+        for (category, name), (count, total, low, high) in self.summary ():
+            lines.append ("{:<12} {:<40} {:>6} {:>10.2f} {:>10.2f} {:>10.2f}".format (
+                category[:12], name[:40], count, total * 1000, low * 1000, high * 1000
+            ))
+        return "\n".join (lines)
+
+    def chrome_trace (self):
+        tracks = {}
+        events = []
+        pid = os.getpid ()
+        for span in sorted (self.spans, key = lambda span: span.start):
+            tid = tracks.setdefault (span.track, len (tracks) + 1)
+            events.append ({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": span.start * 1e6,
+                "dur": span.duration * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": {key: str (value) for key, value in span.args.items ()},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace (self, path):
+        import json
+
+        with open (path, "w") as f:
+            json.dump (self.chrome_trace (), f)
+
+Trace = Tracer ()
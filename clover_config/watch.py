@@ -0,0 +1,214 @@
+"""
+clover-config - A clover efi bootloader configuration utility.
+Copyright (C) 2017  Fin Christensen <christensen.fin@gmail.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import os
+import os.path
+import select
+import signal
+import sys
+import time
+
+from clover_config.log import Log
+from clover_config.errors import CloverConfigError, WatchError
+from clover_config.exit_code import ExitCode
+
+# seconds without further events before an update is started
+DEBOUNCE = 2.0
+# seconds after the first event an update is started even if events keep coming
+MAX_DELAY = 30.0
+
+def _terminate (signum, frame):
+    sys.exit (ExitCode.SUCCESS.value)
+
+def _add_file_watch (watches, path):
+    directory, name = os.path.split (os.path.abspath (path))
+    names = watches.setdefault (directory, set ())
+    if names is not None:
+        names.add (name)
+
+def _hash_file (digest, path):
+    try:
+        with open (path, "rb") as f:
+            digest.update (f.read ())
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        digest.update (b"\0missing")
+
+def _hash_directory (digest, path):
+    # kernels and initramfs images are large, so trust their size and mtime
+    try:
+        entries = sorted ((entry.name, entry.stat ()) for entry in os.scandir (path) if entry.is_file ())
+    except (FileNotFoundError, NotADirectoryError):
+        digest.update (b"\0missing")
+        return
+    for name, stat in entries:
+        digest.update ("{}\0{}\0{}\0".format (name, stat.st_size, stat.st_mtime_ns).encode (errors = "surrogateescape"))
+
+class MenuWatcher:
+    """
+    Re-run the menu update whenever the configuration, menu.conf or the
+    kernel directories change.
+
+    Bursts of events, like a package manager installing several kernels,
+    are coalesced until no event arrived for `debounce` seconds. The update
+    is skipped if the fingerprint of all inputs did not change since the
+    last one. With `dry_run` the updates only report what they would write.
+    """
+
+    def __init__ (self, clover, debounce = DEBOUNCE, max_delay = MAX_DELAY, dry_run = False):
+        self.clover = clover
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.dry_run = dry_run
+        self._inotify = None
+        self._relevant = {}
+        self._fingerprint = None
+
+    def get_config_files (self):
+        from clover_config.config import get_config_files
+
+        path = getattr (self.clover.config, "Path", None)
+        return get_config_files (path) if path is not None else []
+
+    def get_watches (self):
+        """
+        Map the watched directories to the names of the files in them whose
+        changes matter, or to None if any change matters.
+        """
+        watches = self._get_config_watches ()
+        _add_file_watch (watches, self.clover.config.MenuFile)
+        for directory in self.clover.config.KernelDirs:
+            watches[os.path.abspath (directory)] = None
+        return watches
+
+    def _get_config_watches (self):
+        """
+        Like `get_watches`, but only for the configuration files, which can be
+        found even if they cannot be parsed.
+        """
+        watches = {}
+        for path in self.get_config_files ():
+            _add_file_watch (watches, path)
+        path = getattr (self.clover.config, "Path", None)
+        if path is not None:
+            # drop-in files that do not exist yet
+            watches[os.path.abspath (path + ".d")] = None
+        return watches
+
+    def fingerprint (self):
+        digest = hashlib.sha256 ()
+        for path in self.get_config_files () + [self.clover.config.MenuFile]:
+            digest.update (path.encode (errors = "surrogateescape") + b"\0")
+            _hash_file (digest, path)
+        for directory in self.clover.config.KernelDirs:
+            digest.update (directory.encode (errors = "surrogateescape") + b"\0")
+            _hash_directory (digest, directory)
+        return digest.hexdigest ()
+
+    def _add_watches (self):
+        try:
+            self._relevant = self.get_watches ()
+        except CloverConfigError as e:
+            # keep the previous watches, but make sure that fixing the configuration is noticed
+            Log.watch.debug ("Cannot update the watched directories: %s", e)
+            for directory, names in self._get_config_watches ().items ():
+                previous = self._relevant.get (directory, set ())
+                self._relevant[directory] = None if names is None or previous is None else names | previous
+        watched = set (self._inotify.watches.values ())
+        for directory in sorted (self._relevant):
+            if directory in watched or not os.path.isdir (directory):
+                continue
+            try:
+                self._inotify.add_watch (directory)
+                Log.watch.debug ("Watching '%s' for changes", directory)
+            except OSError as e:
+                Log.watch.warning ("Cannot watch '%s' for changes: %s", directory, e)
+
+    def _changed (self):
+        """
+        Read the pending events and tell whether any of them matters.
+        """
+        changed = False
+        for event in self._inotify.read ():
+            names = self._relevant.get (self._inotify.watches.get (event.wd), ())
+            if names is None or event.name in names:
+                changed = True
+        return changed
+
+    def _reload_config (self):
+        reset = getattr (self.clover.config, "reset", None)
+        if reset is not None:
+            reset ()
+
+    def update (self, report):
+        self._reload_config ()
+        try:
+            fingerprint = self.fingerprint ()
+            if fingerprint == self._fingerprint:
+                Log.watch.debug ("Nothing effective changed, skipping the update")
+                return
+            report (self.clover.update (dry_run = self.dry_run))
+        except CloverConfigError as e:
+            # keep watching, the next change may well fix the configuration
+            Log.watch.error ("Updating the Clover configuration failed: %s", e)
+            return
+        finally:
+            # watch directories that appeared or were added to the configuration
+            self._add_watches ()
+        self._fingerprint = fingerprint
+
+    def _wait_until_quiet (self, poller):
+        deadline = time.monotonic () + self.max_delay
+        quiet_since = time.monotonic ()
+        while True:
+            now = time.monotonic ()
+            timeout = min (quiet_since + self.debounce, deadline) - now
+            if timeout <= 0 or len (poller.poll (timeout * 1000)) == 0:
+                return
+            if self._changed ():
+                quiet_since = time.monotonic ()
+
+    def run (self, report):
+        """
+        Update once and then after every burst of changes until terminated.
+        `report` is called with the `UpdateResult` of every update.
+        """
+        from clover_config.inotify import Inotify
+
+        try:
+            self._inotify = Inotify ()
+        except OSError as e:
+            raise WatchError ("Cannot watch for changes: {}".format (e))
+
+        signal.signal (signal.SIGTERM, _terminate)
+        try:
+            poller = select.poll ()
+            poller.register (self._inotify, select.POLLIN)
+            self.update (report)
+            Log.watch.info ("Watching for configuration and kernel changes...")
+            while True:
+                poller.poll ()
+                if not self._changed ():
+                    continue
+                self._wait_until_quiet (poller)
+                self.update (report)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._inotify.close ()
+            self._inotify = None
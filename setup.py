@@ -50,7 +50,7 @@ setup (
     install_requires = ["colorlog"],
     extras_require = {},
     package_data = {
-        "music_sync": [],
+        "clover_config": ["data/*.xml"],
     },
     data_files = [],
     entry_points = {